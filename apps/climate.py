@@ -1,17 +1,29 @@
 import attr
+import bisect
+import concurrent.futures
 import math
+import threading
 import datetime
 from enum import Enum
-import time
 
 import appdaemon.plugins.hass.hassapi as hass
 
+import instrumentation
 import utils
 
 
 __VERSION__ = "0.3.3"
 MIN_TEMP = 8
 MAX_TEMP = 28
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+OPTIONS_TIMEOUT = 10  # Seconds to wait for home assistant to confirm the mode options
+PREHEAT_ALPHA = 0.1  # Weight of a new sample in the learned heating rate
+PREHEAT_MIN_DEMAND = 0.5  # Only learn while the room is at least this many degrees below its setpoint
+PREHEAT_MAX_GAP = 60  # Samples further apart (minutes) do not tell anything about the heating rate
+PREHEAT_SAVE_INTERVAL = 15 * 60  # Seconds between persisting the learned heating rates
+PREHEAT_LOOKAHEAD = 7 * 24 * 60 * 60  # Seconds of upcoming setpoints to plan the next preheat start for (a week)
+SNAPSHOT_ENTITY_READS = 16  # Passes reading more entities than this read the domains in bulk instead
 
 
 class Mode (Enum):
@@ -36,17 +48,96 @@ class Mode (Enum):
             raise ValueError("Argument label '{label}' is expected to be valid mode, but is not".format(**locals()))
 
 
-@attr.s
+@attr.s(slots=True)
 class Thermostat:
+    SERVICE = None  # The service to write the setpoint ...
+    FIELD = None  # ... and its field carrying the setpoint
+
     name = attr.ib(type=str)
     offset = attr.ib(type=(int, float), default=0)
     force = attr.ib(type=(None, bool), default=None)
+    write_delay = attr.ib(type=int, default=0)  # Coalesce all writes within this many seconds into one
+    last_setpoint = attr.ib(type=float, init=False, default=None)  # Last setpoint commanded to the device
+    pending_setpoint = attr.ib(type=float, init=False, default=None)  # Setpoint waiting for the write delay
+    _pending_force = attr.ib(type=bool, init=False, default=False)
 
-    def set_setpoint(self, hass, setpoint, force=False):
+    def current(self, hass, snapshot=None):
         raise NotImplementedError()
 
+    def write(self, hass, setpoint):
+        hass.logger.info("Calling {service} for '{name}' with setpoint '{setpoint}' (offset='{offset}')",
+                         service=self.SERVICE, name=self.name, setpoint=setpoint, offset=self.offset)
+        hass.call_service(self.SERVICE, entity_id=self.name, **{self.FIELD: setpoint})
+
+    def set_setpoint(self, hass, setpoint, force=False, snapshot=None, verify=False, batch=None):
+        """
+        Sets the thermostat to the given setpoint (offset, range and rounding applied). Given a `WriteBatch` the write
+        is collected in the batch instead of calling the service right away.
+        """
+        # Thermostat force overrides global force (if any)
+        _force = self.force if self.force is not None else force
+        range_sp = self.device_setpoint(setpoint)
+        if self.pending_setpoint is not None:
+            # A write is already waiting for the delay to pass: It will carry the latest setpoint
+            self.pending_setpoint = range_sp
+            self._pending_force = self._pending_force or _force
+            return
+        if not _force:
+            # Compare against what was commanded last. Only ask the device if there is nothing to compare against
+            # or if we shall verify the device is still on track.
+            reference = self.last_setpoint
+            if reference is None or verify:
+                reference = self.current(hass, snapshot)
+            if reference is not None and math.isclose(float(reference), float(range_sp)):
+                self.last_setpoint = float(range_sp)  # The device is there already
+                return
+        if self.write_delay > 0:
+            hass.logger.debug("Delaying write of setpoint '{}' for '{}' by {} seconds",
+                              range_sp, self.name, self.write_delay)
+            self.pending_setpoint = range_sp
+            self._pending_force = _force
+            if batch is not None:
+                batch.delay(self)
+            else:
+                hass.run_in(self._on_write_delay, self.write_delay, hass=hass)
+        else:
+            self._command(hass, range_sp, batch)
+
+    def device_setpoint(self, setpoint):
+        """The setpoint as written to the device: Offset, range and rounding applied."""
+        return min(max(MIN_TEMP, int(setpoint + self.offset + 0.5)), MAX_TEMP)
+
+    def commanded(self, setpoint):
+        """Whether the device was set to the given setpoint (and no other one is waiting for the write delay)."""
+        if self.pending_setpoint is not None or self.last_setpoint is None:
+            return False
+        return math.isclose(self.last_setpoint, self.device_setpoint(setpoint))
+
+    def _on_write_delay(self, kwargs):
+        self.flush_pending(kwargs['hass'])
+
+    def flush_pending(self, hass, batch=None):
+        """Writes the setpoint that waited for the write delay to pass (if any)."""
+        setpoint, self.pending_setpoint = self.pending_setpoint, None
+        if setpoint is None:
+            return
+        if not self._pending_force and self.last_setpoint is not None and math.isclose(self.last_setpoint, setpoint):
+            return  # Got back to the setpoint the device already has within the write delay
+        self._command(hass, setpoint, batch)
+
+    def _command(self, hass, setpoint, batch=None):
+        if batch is not None:
+            batch.add(self, setpoint)  # The batch records the setpoint once its call succeeded
+            return
+        try:
+            self.write(hass, setpoint)
+        except:
+            self.last_setpoint = None  # Unknown: Ask the device next time
+            raise
+        self.last_setpoint = float(setpoint)
+
     @classmethod
-    def _factory(cls, tht):
+    def _factory(cls, tht, write_delay):
         entity = tht
         offset = 0
         force = None
@@ -55,75 +146,177 @@ class Thermostat:
             offset = tht['offset']
             force = tht['force']
         if entity.startswith("input_number"):
-            return InputNumberThermostat(name=entity, offset=offset, force=force)
+            return InputNumberThermostat(name=entity, offset=offset, force=force, write_delay=write_delay)
         if entity.startswith("climate"):
-            return ClimateThermostat(name=entity, offset=offset, force=force)
+            return ClimateThermostat(name=entity, offset=offset, force=force, write_delay=write_delay)
         raise NotImplementedError("Sorry but the thermostat '{}' you provided is not supported".format(**locals()))
 
     @classmethod
-    def from_dict(cls, dct):
-        return [cls._factory(tht) for tht in dct]
+    def from_dict(cls, dct, write_delay=0):
+        return tuple(cls._factory(tht, write_delay) for tht in dct)
 
 
-@attr.s
+@attr.s(slots=True)
 class InputNumberThermostat(Thermostat):
-    def set_setpoint(self, hass, setpoint, force=False):
-        # Thermostat force overrides global force (if any)
-        _force = self.force if self.force is not None else force
-        curval = hass.get_state(entity=self.name)
-        offsetted_sp = setpoint + self.offset
-        range_sp = min(max(MIN_TEMP, int(offsetted_sp + 0.5)), MAX_TEMP)  # Min, Max + Rounding
-        if _force or not math.isclose(float(curval), float(range_sp)):
-            hass.log("Calling input_number/set_value for '{self.name}' with setpoint "
-                     "'{range_sp}' (offset='{self.offset}')".format(**locals()))
-            hass.call_service(
-                "input_number/set_value",
-                entity_id=self.name,
-                value=range_sp
-            )
+    SERVICE = "input_number/set_value"
+    FIELD = "value"
 
+    def current(self, hass, snapshot=None):
+        return snapshot.get(self.name) if snapshot is not None else hass.get_state(entity=self.name)
 
-@attr.s
+
+@attr.s(slots=True)
 class ClimateThermostat(Thermostat):
-    def set_setpoint(self, hass, setpoint, force=False):
-        # Thermostat force overrides global force (if any)
-        _force = self.force if self.force is not None else force
-        curval = hass.get_state(entity=self.name, attribute="temperature")
-        offsetted_sp = setpoint + self.offset
-        range_sp = min(max(MIN_TEMP, int(offsetted_sp + 0.5)), MAX_TEMP)  # Min, Max + Rounding
-        if _force or not math.isclose(float(curval), float(range_sp)):
-            hass.log("Calling climate/set_temperature for '{self.name}' with setpoint "
-                     "'{range_sp}' (offset='{self.offset}')".format(**locals()))
-            hass.call_service(
-                "climate/set_temperature",
-                entity_id=self.name,
-                temperature=range_sp
-            )
+    SERVICE = "climate/set_temperature"
+    FIELD = "temperature"
+
+    def current(self, hass, snapshot=None):
+        if snapshot is not None:
+            return snapshot.get(self.name, attribute="temperature")
+        return hass.get_state(entity=self.name, attribute="temperature")
+
+
+@attr.s(slots=True)
+class WriteBatch:
+    """
+    Collects the thermostat writes of an evaluation pass across all rooms. Thermostats of the same domain that end up
+    with the same setpoint are written by a single service call with a list of entities.
+
+    `writes` counts the thermostat writes, `calls` the service calls they take.
+    """
+    groups = attr.ib(type=dict, init=False, default=attr.Factory(dict))  # (service, field, setpoint) -> thermostats
+    delayed = attr.ib(type=dict, init=False, default=attr.Factory(dict))  # write delay -> thermostats
+    writes = attr.ib(type=int, init=False, default=0)
+
+    @property
+    def calls(self):
+        return len(self.groups)
+
+    def add(self, tht, setpoint):
+        self.groups.setdefault((tht.SERVICE, tht.FIELD, setpoint), []).append(tht)
+        self.writes += 1
+
+    def delay(self, tht):
+        self.delayed.setdefault(tht.write_delay, []).append(tht)
+
+    def call(self, hass, key):
+        """
+        Calls the service of a single group of writes. The thermostats of the group remember the setpoint only if the
+        call succeeded.
+        """
+        service, field, setpoint = key
+        thermostats = self.groups[key]
+        entities = [tht.name for tht in thermostats]
+        hass.logger.info("Calling {} for {} with setpoint '{}'", service, entities, setpoint)
+        try:
+            hass.call_service(service, entity_id=entities if len(entities) > 1 else entities[0], **{field: setpoint})
+        except:
+            for tht in thermostats:
+                tht.last_setpoint = None  # Unknown: Ask the device next time
+            raise
+        for tht in thermostats:
+            tht.last_setpoint = float(setpoint)
+
+    def flush(self, hass):
+        """
+        Calls the services of all groups one after another. A failing group does not keep the others from being
+        written. Returns the keys of the failed groups.
+        """
+        failed = []
+        for key in self.groups:
+            try:
+                self.call(hass, key)
+            except Exception as ex:
+                hass.logger.error("Setting thermostats {} failed: {}", [tht.name for tht in self.groups[key]], ex)
+                failed.append(key)
+        return failed
+
+
+@attr.s(slots=True)
+class StateSnapshot:
+    """
+    The states of the home assistant entities an evaluation pass reads: Fetched in bulk, either per domain or per
+    entity (see `App._snapshot`). One snapshot serves every state read (constraints and thermostats) of one pass.
+
+    Constraint values are memoized for the pass. `constraint_reads` counts the constraints actually read,
+    `constraint_reads_avoided` the ones of the evaluated controls that did not have to be read (schedule not active,
+    short-circuited by a preceding false constraint or already memoized).
+    """
+    states = attr.ib(type=dict)
+    constraint_values = attr.ib(type=dict, init=False, default=attr.Factory(dict))
+    constraint_reads = attr.ib(type=int, init=False, default=0)
+    constraint_reads_avoided = attr.ib(type=int, init=False, default=0)
 
+    @classmethod
+    def fetch(cls, hass, domains=None):
+        """
+        A snapshot of all entities of the given domains (Default: All entities). Appdaemon deep copies the states it
+        returns while holding its global state lock: Reading just the relevant domains keeps that short.
+        """
+        if domains is None:
+            return cls(states=hass.get_state() or {})
+        states = {}
+        for domain in domains:
+            states.update(hass.get_state(domain) or {})
+        return cls(states=states)
 
-@attr.s
+    @classmethod
+    def fetch_entities(cls, hass, entities):
+        """A snapshot of the given entities only: Cheaper than `fetch` for a few entities."""
+        return cls(states={entity: hass.get_state(entity=entity, attribute="all") for entity in entities})
+
+    def get(self, entity, attribute=None):
+        item = self.states.get(entity)
+        if item is None:
+            return None
+        if attribute is None:
+            return item.get("state")
+        return item.get("attributes", {}).get(attribute)
+
+    def constraint(self, entity):
+        value = self.constraint_values.get(entity)
+        if value is None:
+            self.constraint_reads += 1
+            value = self.constraint_values[entity] = BinarySensor.is_on(self.get(entity))
+        return value
+
+    def peek_constraint(self, entity):
+        """
+        Returns the value of a constraint without counting it as read: For consumers other than the evaluation of the
+        schedules (e.g. the setpoint profile), so the counters keep describing the evaluation.
+        """
+        value = self.constraint_values.get(entity)
+        return BinarySensor.is_on(self.get(entity)) if value is None else value
+
+
+@attr.s(slots=True, frozen=True)
 class BinarySensor:
     entity = attr.ib(type=str)
 
     @classmethod
     def from_config(cls, cfg):
-        return [cls(entity=item) for item in cfg]
+        return tuple(cls(entity=item) for item in cfg)
 
-    def current(self, hass):
-        val = hass.get_state(entity=self.entity)
+    @staticmethod
+    def is_on(val):
         return str(val).lower() in ['on', 'true', 'home']
 
-    def on_change(self, hass, callback, room):
-        return hass.listen_state(callback, self.entity, room=room)
+    def current(self, hass, snapshot=None):
+        if snapshot is not None:
+            return snapshot.constraint(self.entity)
+        return self.is_on(hass.get_state(entity=self.entity))
 
 
-@attr.s
+@attr.s(slots=True, frozen=True)
 class Schedule:
     setpoint = attr.ib(type=(float, int))
-    start = attr.ib(type=datetime.time)
-    end = attr.ib(type=datetime.time)
-    weekdays = attr.ib(type=(list, None))
-    constraints = attr.ib(type=list)
+    start = attr.ib(type=int)  # Minute of the day
+    end = attr.ib(type=int)  # Minute of the day
+    weekdays = attr.ib(type=int)  # Bit mask: Bit 0 is monday, ..., bit 6 is sunday
+    constraints = attr.ib(type=tuple)
+
+    def on_weekday(self, wday):
+        return bool(self.weekdays >> (wday - 1) & 1)
 
     @staticmethod
     def _make_weekday_list(literal):
@@ -142,32 +335,125 @@ class Schedule:
             return [int(literal)]
         raise NotImplementedError()
 
+    @classmethod
+    def _make_weekday_mask(cls, literal):
+        return sum(1 << (wday - 1) for wday in set(cls._make_weekday_list(literal)) if 1 <= wday <= 7)
+
     @classmethod
     def from_dict(cls, dct):
-        return [cls(
+        return tuple(cls(
             setpoint=sched["setpoint"],
-            start=sched["start"],
-            end=sched["end"],
-            weekdays=cls._make_weekday_list(sched.get("weekdays")),
+            start=sched["start"].hour * 60 + sched["start"].minute,
+            end=sched["end"].hour * 60 + sched["end"].minute,
+            weekdays=cls._make_weekday_mask(sched.get("weekdays")),
             constraints=BinarySensor.from_config(sched.get("constraints", []))
-        ) for sched in dct]
+        ) for sched in dct)
+
+
+@attr.s(slots=True, frozen=True)
+class ScheduleIndex:
+    """
+    Sorted interval index over the 7 x 1440 minutes of a week. The segment at position `i` starts at `boundaries[i]`
+    and holds the schedules (in configuration order) whose time window and weekdays cover that segment.
+    """
+    boundaries = attr.ib(type=tuple)
+    segments = attr.ib(type=tuple)
+
+    @staticmethod
+    def minute_of_week(dt):
+        return dt.weekday() * MINUTES_PER_DAY + dt.hour * 60 + dt.minute
 
+    @staticmethod
+    def _intervals(sched):
+        start, end = sched.start, sched.end
+        for wday in range(1, 8):
+            if not sched.on_weekday(wday):
+                continue
+            offset = (wday - 1) * MINUTES_PER_DAY
+            if start < end:
+                yield offset + start, offset + end
+            else:  # crosses midnight: both parts belong to the same weekday
+                yield offset, offset + end
+                yield offset + start, offset + MINUTES_PER_DAY
+
+    @classmethod
+    def from_schedules(cls, schedules):
+        intervals = [
+            (begin, end, prio)
+            for prio, sched in enumerate(schedules)
+            for begin, end in cls._intervals(sched)
+            if begin < end
+        ]
+        points = sorted({0} | {begin for begin, _, _ in intervals} | {end for _, end, _ in intervals})
+        boundaries, active_prios = [], []
+        for point in points:
+            if point >= MINUTES_PER_WEEK:
+                break
+            prios = tuple(sorted({prio for begin, end, prio in intervals if begin <= point < end}))
+            if active_prios and active_prios[-1] == prios:
+                continue  # Nothing changes at this point
+            boundaries.append(point)
+            active_prios.append(prios)
+        return cls(
+            boundaries=tuple(boundaries),
+            segments=tuple(tuple(schedules[prio] for prio in prios) for prios in active_prios)
+        )
+
+    def lookup(self, minute_of_week):
+        return self.segments[bisect.bisect_right(self.boundaries, minute_of_week) - 1]
 
-@attr.s
+    def transitions(self):
+        """Minutes of the week at which the candidate schedules change."""
+        if len(self.segments) > 1 and self.segments[0] == self.segments[-1]:
+            return self.boundaries[1:]  # The week wraps around without a change at monday midnight
+        return self.boundaries
+
+
+@attr.s(slots=True, frozen=True)
 class Control:
     setpoint = attr.ib(type=(float, int))
-    schedules = attr.ib(type=(list))
+    schedules = attr.ib(type=tuple)
+    index = attr.ib(type=ScheduleIndex)
+    constraint_count = attr.ib(type=int)
+    constraint_entities = attr.ib(type=tuple)
 
     @classmethod
     def from_dict(cls, dct):
-        return cls(setpoint=dct["setpoint"], schedules=Schedule.from_dict(dct.get("schedule", [])))
+        schedules = Schedule.from_dict(dct.get("schedule", []))
+        return cls(
+            setpoint=dct["setpoint"],
+            schedules=schedules,
+            index=ScheduleIndex.from_schedules(schedules),
+            constraint_count=sum(len(sched.constraints) for sched in schedules),
+            constraint_entities=tuple(sorted({c.entity for sched in schedules for c in sched.constraints}))
+        )
 
+    def profile(self, constraint_values):
+        """
+        Computes the weekly setpoint profile in a single pass over the schedule index: The minutes of the week at
+        which the setpoint changes and the setpoints from then on, given the constraint values (entity -> bool).
+        """
+        minutes, setpoints = [], []
+        for boundary, segment in zip(self.index.boundaries, self.index.segments):
+            setpoint = next(
+                (sched.setpoint for sched in segment if all(constraint_values[c.entity] for c in sched.constraints)),
+                self.setpoint
+            )
+            if not setpoints or setpoints[-1] != setpoint:
+                minutes.append(boundary)
+                setpoints.append(setpoint)
+        if len(setpoints) > 1 and setpoints[0] == setpoints[-1]:
+            minutes, setpoints = minutes[1:], setpoints[1:]  # No change when the week wraps around
+        return tuple(minutes), tuple(setpoints)
 
-@attr.s
+
+@attr.s(slots=True)
 class SetpointSensor:
     name = attr.ib(type=str)
     attributes = attr.ib(type=dict)
+    timeline = attr.ib(type=int, default=0)  # Seconds of upcoming setpoints to publish (0 = none)
     last_setpoint = attr.ib(type=float, init=False, default=None)
+    last_timeline = attr.ib(type=list, init=False, default=None)
 
     @classmethod
     def from_dict(cls, dct, room_name):
@@ -178,100 +464,273 @@ class SetpointSensor:
             attributes["unit_of_measurement"] = "°C"
         return cls(
             name="sensor.{name}".format(**locals()),
-            attributes=attributes
+            attributes=attributes,
+            timeline=dct.get("timeline", 0)
         )
 
-    def publish(self, hass, setpoint):
-        if self.last_setpoint is None or not math.isclose(float(self.last_setpoint), float(setpoint)):
+    def publish(self, hass, setpoint, timeline=None):
+        timeline = [[at.isoformat(), sp] for at, sp in timeline or []]
+        setpoint_changed = self.last_setpoint is None or not math.isclose(float(self.last_setpoint), float(setpoint))
+        if setpoint_changed or timeline != (self.last_timeline or []):
             uom = self.attributes.get("unit_of_measurement")
-            hass.log("Setting sensor '{self.name}' to targt temperature '{setpoint} {uom}'".format(**locals()))
-            hass.set_state(entity_id=self.name, state=setpoint, attributes=self.attributes)
+            hass.logger.debug("Setting sensor '{}' to targt temperature '{} {}'", self.name, setpoint, uom)
+            attributes = dict(self.attributes, timeline=timeline) if timeline else self.attributes
+            hass.set_state(entity_id=self.name, state=setpoint, attributes=attributes)
             self.last_setpoint = float(setpoint)
+            self.last_timeline = timeline
+
+
+@attr.s(slots=True)
+class Preheat:
+    """
+    Starts heating ahead of a schedule so that the room reaches the upcoming setpoint right when the schedule starts.
+    The heating rate (degrees per minute) is learned online from the temperature sensor of the room: Each sample taken
+    while the room heats up updates an exponentially weighted moving average.
+    """
+    sensor = attr.ib(type=str)
+    max_lead = attr.ib(type=int)  # Seconds to start heating ahead at most
+    rate = attr.ib(type=float, default=None)  # Learned degrees per minute
+    target = attr.ib(type=float, init=False, default=None)  # The setpoint last applied to the room
+    latched = attr.ib(type=tuple, init=False, default=None)  # (start, setpoint) of the transition being preheated for
+    next_start = attr.ib(type=datetime.datetime, init=False, default=None)  # When preheating is due next (if at all)
+    _last_sample = attr.ib(type=tuple, init=False, default=None)  # (datetime, temperature)
 
+    @classmethod
+    def from_dict(cls, dct):
+        return cls(sensor=dct["sensor"], max_lead=dct["max_lead"], rate=dct.get("rate"))
 
-@attr.s
+    @staticmethod
+    def _temperature(val):
+        try:
+            return float(val)
+        except (ValueError, TypeError):
+            return None  # Unknown or unavailable
+
+    def reset(self):
+        """Forgets the target and the planned preheating: Heating is off."""
+        self.target = self.latched = self.next_start = self._last_sample = None
+
+    def learn(self, dt, value, heating=True):
+        """Takes a temperature sample. Only samples taken while the thermostats are set to `target` are learned."""
+        temperature = self._temperature(value)
+        if temperature is None or not heating:
+            self._last_sample = None  # Starts over once heating
+            return
+        last, self._last_sample = self._last_sample, (dt, temperature)
+        if last is None or self.target is None or self.target - last[1] < PREHEAT_MIN_DEMAND:
+            return  # Not heating up
+        minutes = (dt - last[0]).total_seconds() / 60
+        if minutes <= 0 or minutes > PREHEAT_MAX_GAP:
+            return
+        sample = max(0.0, (temperature - last[1]) / minutes)
+        self.rate = sample if self.rate is None else self.rate + PREHEAT_ALPHA * (sample - self.rate)
+
+    def adjust(self, room, mode, hass, dt, setpoint, snapshot):
+        """
+        Returns the upcoming setpoint if it is time to start heating towards it; otherwise `setpoint`. Once started,
+        preheating sticks to the upcoming setpoint until its transition starts - even if the room gets there early.
+        Plans `next_start` for the transitions that are not due yet.
+        """
+        timeline = room.setpoint_timeline(mode, hass, dt, PREHEAT_LOOKAHEAD, snapshot)[1:]
+        if self.latched is not None and (self.latched not in timeline or self.latched[1] <= setpoint):
+            self.latched = None  # Started, or the schedule changed in the meantime
+        self.next_start = None
+        temperature = self._temperature(snapshot.get(self.sensor))
+        if self.latched is None and temperature is not None and self.rate:
+            for start, upcoming in timeline:
+                if upcoming <= setpoint or upcoming <= temperature:
+                    continue
+                lead = datetime.timedelta(minutes=(upcoming - temperature) / self.rate)
+                at = max(start - lead, start - datetime.timedelta(seconds=self.max_lead))
+                if dt >= at:
+                    hass.logger.info("Preheating '{}' to '{}' for {}", room.name, upcoming, start)
+                    self.latched = (start, upcoming)
+                    break
+                if self.next_start is None or at < self.next_start:
+                    self.next_start = at
+        if self.latched is not None:
+            self.next_start = None
+            setpoint = self.latched[1]
+        self.target = setpoint
+        return setpoint
+
+
+@attr.s(slots=True, frozen=True)
 class Room:
     name = attr.ib(type=str)
-    thermostats = attr.ib(type=list)
+    thermostats = attr.ib(type=tuple)
     controls = attr.ib(type=dict)
     setpoint_sensor = attr.ib(type=SetpointSensor)
+    preheat = attr.ib(type=Preheat)
+    _profiles = attr.ib(type=dict, init=False, default=attr.Factory(dict))  # (mode, constraint values) -> profile
 
     @classmethod
-    def from_dict(cls, dct):
+    def from_dict(cls, dct, write_delay=0):
         def mk_setpoint_sensor(room_name, dct):
             if "setpoint_sensor" not in dct:
                 return None  # We do not want to use a sensor
             return SetpointSensor.from_dict(dct["setpoint_sensor"] or {}, room_name)
 
-        return [cls(
+        return tuple(cls(
             name=rname,
-            thermostats=Thermostat.from_dict(rdct["thermostats"]),
+            thermostats=Thermostat.from_dict(rdct["thermostats"], write_delay),
             controls={mode: Control.from_dict(rdct[mode.value]) for mode in Mode if mode is not Mode.Off},
-            setpoint_sensor=mk_setpoint_sensor(rname, rdct)
-        ) for rname, rdct in dct.items()]
-
-    @staticmethod
-    def _is_time_between(begin_time, end_time, check_time=None):
-        # If check time is not given, default to current UTC time
-        check_time = check_time or datetime.datetime.now().time()
-        if begin_time < end_time:
-            return check_time >= begin_time and check_time <= end_time
-        else:  # crosses midnight
-            return check_time >= begin_time or check_time <= end_time
-
-    def eval_setpoint(self, mode, hass, dt_override=None):
+            setpoint_sensor=mk_setpoint_sensor(rname, rdct),
+            preheat=Preheat.from_dict(rdct["preheat"]) if rdct.get("preheat") else None
+        ) for rname, rdct in dct.items())
+
+    def entities(self):
+        """Returns every entity the evaluation of the room reads: Thermostats, constraints and the preheat sensor."""
+        entities = {tht.name for tht in self.thermostats}
+        for ctrl in self.controls.values():
+            entities.update(ctrl.constraint_entities)
+        if self.preheat:
+            entities.add(self.preheat.sensor)
+        return entities
+
+    def commanded(self, setpoint):
+        """Whether all thermostats of the room were set to the given setpoint."""
+        return setpoint is not None and all(tht.commanded(setpoint) for tht in self.thermostats)
+
+    def eval_setpoint(self, mode, hass, dt_override=None, snapshot=None):
         if mode is Mode.Off:
             return None
         dt = dt_override or datetime.datetime.now()
-        wday = dt.weekday() + 1
+        snapshot = snapshot if snapshot is not None else StateSnapshot.fetch(hass)
         ctrl = self.controls.get(mode)
         if not ctrl:
             raise ValueError("Given mode '{mode}' is not a control mode".format(**locals()))
-        for sched in ctrl.schedules:
-            start, end = sched.start, sched.end
-            check_time = self._is_time_between(start, end, check_time=dt.time())
-            check_weekdays = wday in sched.weekdays
-            check_constraints = all([c.current(hass) for c in sched.constraints])
-            if check_time and check_weekdays and check_constraints:
-                return sched.setpoint
-        return ctrl.setpoint  # Default setpoint when no schedule matches
-
-    def set_setpoint_sensor(self, hass, setpoint):
+        reads = snapshot.constraint_reads
+        setpoint = ctrl.setpoint  # Default setpoint when no schedule matches
+        # Only schedules covering the current minute of the week are candidates (in configuration order).
+        # Their constraints are read lazily and stop at the first one being false.
+        for sched in ctrl.index.lookup(ScheduleIndex.minute_of_week(dt)):
+            if all(c.current(hass, snapshot) for c in sched.constraints):
+                setpoint = sched.setpoint
+                break
+        snapshot.constraint_reads_avoided += ctrl.constraint_count - (snapshot.constraint_reads - reads)
+        return setpoint
+
+    def setpoint_profile(self, mode, hass, snapshot=None):
+        """
+        Returns the weekly setpoint profile of the given mode (see `Control.profile`) assuming the current constraint
+        values persist. Profiles are computed once per mode and combination of constraint values.
+        """
+        ctrl = self.controls[mode]
+        snapshot = snapshot if snapshot is not None else StateSnapshot.fetch(hass)
+        values = tuple(snapshot.peek_constraint(entity) for entity in ctrl.constraint_entities)
+        profile = self._profiles.get((mode, values))
+        if profile is None:
+            profile = self._profiles[(mode, values)] = ctrl.profile(dict(zip(ctrl.constraint_entities, values)))
+        return profile
+
+    def setpoint_timeline(self, mode, hass, dt, horizon, snapshot=None):
+        """
+        Returns the setpoints from `dt` until `horizon` seconds later as a list of (datetime, setpoint). The first item
+        is the current setpoint (with the point in time it became active), followed by every upcoming change.
+        """
+        minutes, setpoints = self.setpoint_profile(mode, hass, snapshot)
+        week_start = datetime.datetime.combine(dt.date() - datetime.timedelta(days=dt.weekday()), datetime.time())
+        pos, week = bisect.bisect_right(minutes, ScheduleIndex.minute_of_week(dt)) - 1, 0
+        if pos < 0:  # The current setpoint became active in the previous week
+            pos, week = len(minutes) - 1, -1
+        end = dt + datetime.timedelta(seconds=horizon)
+        timeline = []
+        while True:
+            at = week_start + datetime.timedelta(weeks=week, minutes=minutes[pos])
+            if at > end:
+                return timeline
+            if not timeline or timeline[-1][1] != setpoints[pos]:
+                timeline.append((at, setpoints[pos]))
+            pos += 1
+            if pos == len(minutes):
+                pos, week = 0, week + 1
+
+    def set_setpoint_sensor(self, hass, setpoint, mode=None, dt=None, snapshot=None):
         if self.setpoint_sensor:
-            self.setpoint_sensor.publish(hass, setpoint)
-
-    def update_setpoints(self, hass, mode, dt_override=None, force=False):
+            timeline = None
+            if self.setpoint_sensor.timeline and mode is not None and mode is not Mode.Off:
+                dt = dt or datetime.datetime.now()
+                timeline = self.setpoint_timeline(mode, hass, dt, self.setpoint_sensor.timeline, snapshot)
+            self.setpoint_sensor.publish(hass, setpoint, timeline)
+
+    def target_setpoint(self, mode, hass, dt, snapshot):
+        """The scheduled setpoint (see `eval_setpoint`) - or the upcoming one when it is time to preheat."""
+        setpoint = self.eval_setpoint(mode, hass, dt, snapshot=snapshot)
+        if self.preheat and setpoint is not None:
+            setpoint = self.preheat.adjust(self, mode, hass, dt, setpoint, snapshot)
+        return setpoint
+
+    def update_setpoints(self, hass, mode, dt_override=None, force=False, snapshot=None, verify=False, batch=None):
         if mode is Mode.Off:
             return
-        setpoint = self.eval_setpoint(mode, hass, dt_override)
-        hass.log("Evaluated setpoint for '{self.name}' to '{setpoint}'".format(**locals()))
-        self.set_setpoint_sensor(hass, setpoint)
+        dt_override = dt_override or datetime.datetime.now()
+        snapshot = snapshot if snapshot is not None else StateSnapshot.fetch(hass)
+        setpoint = self.target_setpoint(mode, hass, dt_override, snapshot)
+        hass.logger.debug("Evaluated setpoint for '{}' to '{}'", self.name, setpoint)
+        self.set_setpoint_sensor(hass, setpoint, mode, dt_override, snapshot)
         for tht in self.thermostats:
-            tht.set_setpoint(hass, setpoint, force=force)
+            tht.set_setpoint(hass, setpoint, force=force, snapshot=snapshot, verify=verify, batch=batch)
 
 
-@attr.s
+@attr.s(slots=True, frozen=True)
 class Config:
     mode_entity = attr.ib(type=str)
     mode_map = attr.ib(type=dict)
     mode_init_options = attr.ib(type=bool)
     check_interval = attr.ib(type=int)
     force_set_on_interval = attr.ib(type=bool)
-    rooms = attr.ib(type=list)
+    write_delay = attr.ib(type=int)
+    concurrency = attr.ib(type=int)
+    log_level = attr.ib(type=str)
+    rooms = attr.ib(type=tuple)
+    dependencies = attr.ib(type=dict)  # Constraint entity -> mode -> rooms depending on it
+    domains = attr.ib(type=tuple)  # The domains of all entities the rooms read
+    _transitions = attr.ib(type=dict, init=False, default=attr.Factory(dict))
 
     @classmethod
     def from_dict(cls, dct):
         mode_node = dct["mode"]
-        rooms_node = dct["rooms"]
+        rooms = Room.from_dict(dct["rooms"], dct.get("write_delay", 0))
         return cls(
             mode_entity=mode_node["entity"],
             mode_map=mode_node.get("map"),
             mode_init_options=mode_node.get("init_options", False),
             check_interval=dct["check_interval"],
             force_set_on_interval=dct["force_set_on_interval"],
-            rooms=Room.from_dict(rooms_node)
+            write_delay=dct.get("write_delay", 0),
+            concurrency=dct.get("concurrency", 4),
+            log_level=dct.get("log_level", "INFO"),
+            rooms=rooms,
+            dependencies=cls._make_dependencies(rooms),
+            domains=tuple(sorted({entity.partition(".")[0] for room in rooms for entity in room.entities()}))
         )
 
+    @staticmethod
+    def _make_dependencies(rooms):
+        dependencies = {}
+        for room in rooms:
+            for mode, ctrl in room.controls.items():
+                for sched in ctrl.schedules:
+                    for c in sched.constraints:
+                        dependent = dependencies.setdefault(c.entity, {}).setdefault(mode, [])
+                        if room not in dependent:
+                            dependent.append(room)
+        return dependencies
+
+    def transitions(self, mode):
+        """
+        Returns the sorted minutes of the week at which the schedules of any room change in the given mode and a
+        mapping of those minutes to the affected rooms.
+        """
+        if mode not in self._transitions:
+            rooms_by_minute = {}
+            for room in self.rooms:
+                for minute in room.controls[mode].index.transitions():
+                    rooms_by_minute.setdefault(minute, []).append(room)
+            self._transitions[mode] = (sorted(rooms_by_minute), rooms_by_minute)
+        return self._transitions[mode]
+
 
 class Validator:
     from voluptuous import Schema, Required, Optional, Range, All, Or
@@ -308,13 +767,24 @@ class Validator:
         }
     ))
 
+    ROOM_PREHEAT_SCHEMA = Schema({
+        Required("sensor"): str,
+        Optional("max_lead", default="2h"): utils.parse_duration_literal,
+        Optional("rate", default=None): Or(None, float, int)
+    })
+
     ROOM_SETPOINT_SENSOR_SCHEMA = Schema({
         Optional("name", default=None): Or(None, str),
+        Optional("timeline", default=0): utils.parse_duration_literal,
         Optional("attributes", default={}): {str: object}
     })
 
     SCHEMA = Schema({
         Optional("check_interval", default=0): utils.parse_duration_literal,
+        Optional("write_delay", default=0): utils.parse_duration_literal,
+        Optional("concurrency", default=4): All(int, Range(min=1)),
+        Optional("storage_dir", default=None): Or(None, str),
+        Optional("log_level", default="INFO"): utils.parse_log_level,
         Required("mode"): {
             Required("entity"): str,
             Optional("map", default={}): {str: str},
@@ -324,6 +794,7 @@ class Validator:
             str: {
                 Required("thermostats"): [THERMOSTAT_SCHEMA],
                 Optional("setpoint_sensor"): Or(ROOM_SETPOINT_SENSOR_SCHEMA, None),
+                Optional("preheat"): ROOM_PREHEAT_SCHEMA,
                 Required("comfort"): HEATING_SCHEMA,
                 Required("energy"): HEATING_SCHEMA,
                 Required("frost"): HEATING_SCHEMA
@@ -337,50 +808,158 @@ class Validator:
 
 
 class App(hass.Hass):
+    metrics = None  # Instrumentation is off
+    _preheat_dirty = False  # Learned heating rates not saved yet
+
     def initialize(self):
         self.log("Climate App @ {version}".format(version=__VERSION__))
-        dct = Validator.validate_config(self.args)
-        self._config = Config.from_dict(dct)
-        self.schedules = []
-        self.on_change_handler = []
+        self.metrics = instrumentation.setup(self, self.args.get("metrics"))
+        self._config = utils.cached_config(
+            self.args,
+            lambda args: Config.from_dict(Validator.validate_config(args)),
+            source=__file__,
+            name=self.name,
+            storage_dir=self.args.get("storage_dir")
+        )
+        self.logger = utils.Logger(self.log, self._config.log_level)
+        self._timers = utils.TimerHeap(self, self._on_timer)  # The next transition and the next preheat start
+        self._preheat_path = utils.storage_path(self.args.get("storage_dir"), "{}-preheat.json".format(self.name))
 
         if self._config.mode_init_options:
-            self._set_options()
-            time.sleep(0.5)  # We have to wait after setting the mode - otherwise the read is "wrong"
+            self._set_options()  # Will start as soon as home assistant confirms the mode options
+        else:
+            self._start()
+
+    def _start(self):
         self._mode = self._resolve_mode(self.get_state(entity=self._config.mode_entity))
-        self.log("Current mode is '{self._mode}'".format(**locals()))
+        self.logger.info("Current mode is '{}'", self._mode)
         self.listen_state(self._on_mode_change, self._config.mode_entity)
 
+        # One listener per constraint entity regardless of how many schedules, rooms and modes use it
+        for entity in self._config.dependencies:
+            self.logger.debug("Creating constraint on change handler for {}", entity)
+            self.listen_state(self._on_constraint_change, entity)
+
+        preheat_rooms = [room for room in self._config.rooms if room.preheat]
+        rates = utils.load_json(self._preheat_path, {})  # Learned before the restart
+        for room in preheat_rooms:
+            room.preheat.rate = rates.get(room.name, room.preheat.rate)
+            self.logger.info("Preheating '{}' with a heating rate of {}", room.name, room.preheat.rate)
+            self.listen_state(self._on_temperature_change, room.preheat.sensor, room=room)
+        if preheat_rooms:
+            self.run_every(
+                self._on_save_preheat,
+                self.datetime() + datetime.timedelta(seconds=PREHEAT_SAVE_INTERVAL),
+                PREHEAT_SAVE_INTERVAL
+            )
+
+        self._preheat_at = None  # When the preheat timer fires
         self._update_setpoints_for_all_rooms()
-        self._make_schedules()
+        self._schedule_next_transition()
         if self._config.check_interval > 0:
             # Run every x `check_interval` seconds and set thermostats to reflect the current configuration
             self.run_every(
                 self._on_interval,
-                datetime.datetime.now() + datetime.timedelta(seconds=self._config.check_interval),
+                self.datetime() + datetime.timedelta(seconds=self._config.check_interval),
                 self._config.check_interval
             )
-        self.log("Climate controller initialized")
-
-    def _on_schedule(self, kwargs):
-        self.log("Scheduled change of setpoints for room '{room.name}'".format(room=kwargs.get('room')))
-        kwargs['room'].update_setpoints(hass=self, mode=self._mode)
+        self.logger.info("Climate controller initialized")
+
+    def _on_timer(self, key, payload):
+        if key == "transition":
+            self._on_transition(*payload)
+        elif key == "preheat":
+            self._on_preheat(payload)
+
+    def _on_transition(self, minute, due):
+        # Never evaluate before the transition even if the timer fires a tad early
+        dt = max(self.datetime(), due)
+        _, rooms_by_minute = self._config.transitions(self._mode)
+        rooms = rooms_by_minute.get(minute, [])
+        self.logger.info("Scheduled change of setpoints for rooms {}", [room.name for room in rooms])
+        self._update_setpoints(rooms, dt_override=dt)
+        self._schedule_next_transition(dt)
 
     def _on_interval(self, kwargs):
-        self.log("On interval thermostat check")
-        self._update_setpoints_for_all_rooms()
+        self.logger.debug("On interval thermostat check")
+        self._update_setpoints_for_all_rooms(verify=True)
 
     def _on_mode_change(self, entity, attribute, old, new, kwargs):
-        self.log("Climate mode changed from '{old}' to '{new}'".format(**locals()))
+        self.logger.info("Climate mode changed from '{}' to '{}'", old, new)
         self._mode = self._resolve_mode(new)
-        self.log("Resolved mode is: '{self._mode}'".format(**locals()))
+        self.logger.info("Resolved mode is: '{}'", self._mode)
+        if self._mode is Mode.Off:
+            for room in self._config.rooms:
+                if room.preheat:
+                    room.preheat.reset()
+            self._schedule_next_preheat()
         self._update_setpoints_for_all_rooms()
-        self._make_schedules()
+        self._schedule_next_transition()
 
     def _on_constraint_change(self, entity, attribute, old, new, kwargs):
-        self.log("Constraint '{entity}' value change from '{old}' to '{new}'".format(**locals()))
-        room = kwargs.pop("room")
-        room.update_setpoints(hass=self, mode=self._mode)
+        self.logger.info("Constraint '{}' value change from '{}' to '{}'", entity, old, new)
+        # Every affected room exactly once
+        rooms = self._config.dependencies.get(entity, {}).get(self._mode)
+        if not rooms:
+            return  # Only used by another mode: Nothing to read
+        self._update_setpoints(rooms)
+
+    def _on_temperature_change(self, entity, attribute, old, new, kwargs):
+        room = kwargs['room']
+        heating = self._mode is not Mode.Off and room.commanded(room.preheat.target)
+        room.preheat.learn(self.datetime(), new, heating)
+        self._preheat_dirty = True
+        if self._mode is not Mode.Off:
+            self._update_setpoints([room])  # Might be time to start preheating
+
+    def _on_preheat(self, due):
+        self._preheat_at = None
+        if self._mode is Mode.Off:
+            return
+        dt = max(self.datetime(), due)  # Never evaluate before the preheat start
+        rooms = [
+            room for room in self._config.rooms
+            if room.preheat and room.preheat.next_start is not None and room.preheat.next_start <= dt
+        ]
+        self.logger.info("Scheduled preheat check for rooms {}", [room.name for room in rooms])
+        self._update_setpoints(rooms, dt_override=dt)
+        self._schedule_next_preheat()  # Even if no room was due
+
+    def _schedule_next_preheat(self):
+        """Arms a single timer for the earliest point in time any room has to start preheating."""
+        starts = [room.preheat.next_start for room in self._config.rooms if room.preheat and room.preheat.next_start]
+        at = min(starts) if starts else None
+        if at == self._preheat_at:
+            return  # Armed already
+        self._preheat_at = at
+        if at is None:
+            self._timers.cancel("preheat")
+        else:
+            self.logger.debug("Next preheat check @ {}", at)
+            self._timers.schedule_at("preheat", at, at)
+
+    def _on_save_preheat(self, kwargs):
+        self._save_preheat()
+
+    def _save_preheat(self):
+        if not self._preheat_dirty:
+            return
+        rates = {room.name: room.preheat.rate for room in self._config.rooms if room.preheat}
+        try:
+            utils.save_json(self._preheat_path, rates)
+            self._preheat_dirty = False
+        except OSError as e:
+            self.logger.warning("Could not save the learned heating rates to '{}': {}", self._preheat_path, e)
+
+    def terminate(self):
+        self._save_preheat()
+
+    def _on_options_ready(self, entity, confirmed):
+        if confirmed:
+            self.logger.info("Mode options confirmed by home assistant")
+        else:
+            self.logger.warning("Mode options not confirmed within {} seconds - starting anyway", OPTIONS_TIMEOUT)
+        self._start()
 
     def _resolve_mode(self, hass_mode):
         mode_label = hass_mode
@@ -389,60 +968,160 @@ class App(hass.Hass):
             mode_label = self._config.mode_map.get(hass_mode, hass_mode)
         return Mode.from_str(mode_label)
 
-    def _make_schedules(self):
-        # Remove old schedules if any
-        self.log("Clearing current schedules")
-        for handle in self.schedules:
-            self.cancel_timer(handle)
-        self.schedules.clear()
-
-        # Remove contraints state change handler
-        self.log("Clearing on_change event handler")
-        for handle in self.on_change_handler:
-            self.cancel_listen_state(handle)
-        self.on_change_handler.clear()
-
-        # New schedules
-        mode = self._mode
-        if mode is Mode.Off:
+    def _schedule_next_transition(self, now=None):
+        """Arms a single timer for the next point in time the schedules of any room change."""
+        self._timers.cancel("transition")
+        if self._mode is Mode.Off:
+            return
+        minutes, _ = self._config.transitions(self._mode)
+        if not minutes:
+            return
+        now = now or self.datetime()
+        pos = bisect.bisect_right(minutes, ScheduleIndex.minute_of_week(now))
+        minute, weeks = (minutes[pos], 0) if pos < len(minutes) else (minutes[0], 1)  # Wrap to next week
+        week_start = datetime.datetime.combine(now.date() - datetime.timedelta(days=now.weekday()), datetime.time())
+        at = week_start + datetime.timedelta(weeks=weeks, minutes=minute)
+        self.logger.debug("Next scheduled change of setpoints @ {}", at)
+        self._timers.schedule_at("transition", at, (minute, at))
+
+    @instrumentation.timed("update_setpoints")
+    def _update_setpoints(self, rooms, dt_override=None, force=False, verify=False, snapshot=None):
+        """
+        Updates the setpoints of the given rooms. The rooms share a single state snapshot (Default: See `_snapshot`)
+        and their thermostat writes are grouped into as few service calls as possible.
+        """
+        dt = dt_override or self.datetime()
+        snapshot = snapshot if snapshot is not None else self._snapshot(rooms)
+        batch = WriteBatch()
+        for room in rooms:
+            room.update_setpoints(
+                hass=self, mode=self._mode, dt_override=dt, force=force, snapshot=snapshot, verify=verify, batch=batch
+            )
+        self._write(batch)
+        if any(room.preheat for room in rooms):
+            self._schedule_next_preheat()  # The preheat starts were planned anew
+        return snapshot, batch
+
+    def _snapshot(self, rooms):
+        """
+        Reads the states the given rooms depend on: Entity by entity for a few rooms, the domains of the rooms in bulk
+        otherwise.
+        """
+        entities = set().union(*(room.entities() for room in rooms))
+        if len(entities) <= SNAPSHOT_ENTITY_READS:
+            return StateSnapshot.fetch_entities(self, entities)
+        return StateSnapshot.fetch(self, self._config.domains)
+
+    def _write(self, batch):
+        for delay, thermostats in batch.delayed.items():
+            self.run_in(self._on_write_delay, delay, thermostats=thermostats)
+        failed = batch.flush(self)
+        if failed:
+            self.logger.warning("{} of {} service calls failed. The thermostats will be written again on the next "
+                                "evaluation", len(failed), batch.calls)
+
+    def _on_write_delay(self, kwargs):
+        batch = WriteBatch()
+        for tht in kwargs['thermostats']:
+            tht.flush_pending(self, batch)
+        self._write(batch)
+        self.logger.info("Wrote {} delayed thermostat setpoints with {} service calls", batch.writes, batch.calls)
+
+    def _update_setpoints_for_all_rooms(self, verify=False):
+        if self._mode is Mode.Off:
             return
-        for room in self._config.rooms:
-            for sched in room.controls[mode].schedules:
-                start, end = sched.start, sched.end
-                self.log("Creating schedule for room '{room.name}' @ {start} @ '{mode}'".format(**locals()))
-                self.schedules.append(self.run_daily(self._on_schedule, start, room=room))
-                self.log("Creating schedule for room '{room.name}' @ {end} @ '{mode}'".format(**locals()))
-                self.schedules.append(self.run_daily(self._on_schedule, end, room=room))
-                for c in sched.constraints:
-                    self.log("Creating constraint on change handler for {c.entity} @ {room.name}".format(**locals()))
-                    self.on_change_handler.append(c.on_change(self, self._on_constraint_change, room))
-
-    def _update_setpoints_for_all_rooms(self):
-        for room in self._config.rooms:
-            room.update_setpoints(hass=self, mode=self._mode, force=self._config.force_set_on_interval)
+        snapshot, batch = self._update_setpoints(
+            self._config.rooms, force=self._config.force_set_on_interval, verify=verify
+        )
+        self.logger.debug("Evaluated {rooms} rooms: {snapshot.constraint_reads} constraint reads, "
+                          "{snapshot.constraint_reads_avoided} avoided",
+                          rooms=len(self._config.rooms), snapshot=snapshot)
+        delayed = sum(len(thermostats) for thermostats in batch.delayed.values())
+        self.logger.info("Wrote {batch.writes} thermostat setpoints with {batch.calls} service calls "
+                         "({saved} saved), {delayed} delayed", batch=batch, saved=batch.writes - batch.calls,
+                         delayed=delayed)
 
     def _set_options(self):
         # Memorize current state. set_options will revert the selection
-        curstate = self.get_state(entity=self._config.mode_entity)
-        self.log("Current mode is {curstate}".format(**locals()))
+        entity = self._config.mode_entity
+        current = self.get_state(entity=entity, attribute="all") or {}
+        curstate = current.get("state")
+        self.logger.info("Current mode is {}", curstate)
 
         invert_map = {mode: mode.value for mode in Mode}
         invert_map.update({Mode.from_str(v): k for k, v in self._config.mode_map.items()})
         options = [invert_map.get(mode, mode.value) for mode in Mode]
-        self.log("Setting mode options to {options}".format(**locals()))
+        if curstate not in options:
+            # The previous state of the mode entity is not longer a valid one - fallback
+            self.logger.info("Previous mode is not longer valid - reverting to mode = off")
+            curstate = invert_map[Mode.Off]
+        if current.get("attributes", {}).get("options") == options and current.get("state") == curstate:
+            self.logger.info("Mode options are already up to date")
+            self._start()
+            return
+
+        # Start as soon as home assistant reports the restored mode (listen before calling the services)
+        utils.StateAwaiter(
+            self, entity, self._on_options_ready, state=curstate, attributes={"options": options},
+            timeout=OPTIONS_TIMEOUT
+        )
+        self.logger.info("Setting mode options to {}", options)
         self.call_service(
             "input_select/set_options",
-            entity_id=self._config.mode_entity,
+            entity_id=entity,
             options=options
         )
-
-        if curstate not in options:
-            # The previous state of the mode entity is not longer a valid one - fallback
-            self.log("Previous mode is not longer valid - reverting to mode = off")
-            curstate = invert_map[Mode.Off]
         # Restore the previous state if possible
-        self.log("Restoring mode to {curstate}".format(**locals()))
-        self.call_service("input_select/select_option", entity_id=self._config.mode_entity, option=curstate)
+        self.logger.info("Restoring mode to {}", curstate)
+        self.call_service("input_select/select_option", entity_id=entity, option=curstate)
+
+
+class AsyncApp(App):
+    """
+    Climate controller that issues the service calls of an evaluation pass concurrently instead of one after another.
+    The number of concurrent calls is limited by `concurrency`. AppDaemon 3 runs app callbacks on its worker threads
+    only, so the calls are fanned out on a dedicated thread pool and do not occupy further worker threads.
+
+    The writes to a single thermostat keep their order: A write waits for the previous write to the same thermostat.
+    """
+    _pool = None
+    _pool_lock = threading.Lock()  # Writes are issued from any of the worker threads
+    _in_flight = None  # Thermostat entity -> future of its latest write
+
+    def terminate(self):
+        super().terminate()
+        with self._pool_lock:
+            pool, self._pool, self._in_flight = self._pool, None, None
+        if pool is not None:
+            pool.shutdown(wait=False)
+
+    def _write(self, batch):
+        for delay, thermostats in batch.delayed.items():
+            self.run_in(self._on_write_delay, delay, thermostats=thermostats)
+        # Evaluation is cheap and in-memory (snapshot) - only the grouped service calls are worth to fan out. The
+        # worker thread does not wait for them
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=self._config.concurrency)
+                self._in_flight = {}
+            for key, thermostats in batch.groups.items():
+                for tht in thermostats:
+                    # Passes running while the write is in flight compare against the commanded setpoint. The call
+                    # resets it if the write fails
+                    tht.last_setpoint = float(key[2])
+                previous = {self._in_flight[tht.name] for tht in thermostats if tht.name in self._in_flight}
+                future = self._pool.submit(self._call, batch, key, previous)
+                future.add_done_callback(self._on_write_done)
+                self._in_flight.update((tht.name, future) for tht in thermostats)
+
+    def _call(self, batch, key, previous):
+        # The pool starts its calls in the order they were submitted: The previous writes are running already
+        concurrent.futures.wait(previous)
+        batch.call(self, key)
+
+    def _on_write_done(self, future):
+        if future.exception() is not None:
+            self.logger.error("Setting thermostats failed: {}", future.exception())
 
 
 Climate = App  # Backwards compat
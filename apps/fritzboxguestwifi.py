@@ -1,12 +1,17 @@
 import appdaemon.plugins.hass.hassapi as hass
 
+import instrumentation
+
 
 __VERSION__ = "0.3.0"
 
 
 class App(hass.Hass):
+    metrics = None  # Instrumentation is off
+
     def initialize(self):
         self.log("Setting up FRITZ!Box Guest Wifi app")
+        self.metrics = instrumentation.setup(self, self.args.get("metrics"))
 
         import fritzconnection.fritzconnection as fc
         self.host = self.args.get('host', fc.FRITZ_IP_ADDRESS)
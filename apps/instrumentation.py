@@ -0,0 +1,217 @@
+"""
+Instrumentation shared by all apps: Counts the home assistant calls (`get_state`, `call_service`, `set_state`) and the
+timer fires of an app and records the latency of its callbacks in histograms.
+
+The metrics are published periodically as a sensor entity and optionally as a Prometheus text file (e.g. for the
+textfile collector of the node exporter). Instrumentation is off unless the app configures `metrics`:
+
+    metrics:
+      sensor: sensor.climate_metrics  # Default: sensor.<app name>_metrics
+      interval: 5m  # Publish every interval. Default: 5m
+      prometheus: /conf/metrics/climate.prom  # Optional
+
+When it is off nothing is wrapped at all; `timed` costs a single attribute lookup.
+"""
+import bisect
+import contextlib
+import datetime
+import functools
+import threading
+import time
+
+import attr
+from voluptuous import Schema, Optional, Or
+
+import utils
+
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # Seconds
+COUNTED_CALLS = ("get_state", "call_service", "set_state")
+CALLBACK_REGISTRATIONS = ("listen_state", "run_in", "run_at", "run_once", "run_every", "run_daily", "run_hourly")
+TIMER_REGISTRATIONS = frozenset(CALLBACK_REGISTRATIONS) - {"listen_state"}
+
+SCHEMA = Schema({
+    Optional("sensor", default=None): Or(None, str),
+    Optional("interval", default="5m"): utils.parse_duration_literal,
+    Optional("prometheus", default=None): Or(None, str)
+})
+
+
+@attr.s(slots=True)
+class Histogram:
+    """A fixed bucket histogram: Takes constant memory regardless of the number of observations."""
+    counts = attr.ib(type=list, default=attr.Factory(lambda: [0] * (len(BUCKETS) + 1)))  # The last one is +Inf
+    total = attr.ib(type=float, default=0.0)
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.total += value
+
+    def quantile(self, q):
+        """Returns the upper bound of the bucket holding the `q` quantile (None if there are no observations)."""
+        rank, seen = q * self.count, 0
+        for bound, count in zip(BUCKETS + (float("inf"),), self.counts):
+            seen += count
+            if count and seen >= rank:
+                return bound
+        return None
+
+
+@attr.s(slots=True)
+class Metrics:
+    """Counters and latency histograms of one app. Safe to be updated from several threads."""
+    app = attr.ib(type=str)
+    counters = attr.ib(type=dict, default=attr.Factory(dict))  # (metric, name) -> count
+    histograms = attr.ib(type=dict, default=attr.Factory(dict))  # (metric, name) -> Histogram
+    _lock = attr.ib(init=False, default=attr.Factory(threading.Lock))
+
+    def inc(self, metric, name, value=1):
+        with self._lock:
+            self.counters[(metric, name)] = self.counters.get((metric, name), 0) + value
+
+    def observe(self, metric, name, value):
+        with self._lock:
+            histogram = self.histograms.get((metric, name))
+            if histogram is None:
+                histogram = self.histograms[(metric, name)] = Histogram()
+            histogram.observe(value)
+
+    @contextlib.contextmanager
+    def time(self, name, metric="callback_duration_seconds"):
+        """Records the time spent in the `with` block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(metric, name, time.perf_counter() - start)
+
+    def as_attributes(self):
+        """Returns the metrics as sensor attributes: Counters by metric and a summary per histogram."""
+        with self._lock:
+            attributes = {}
+            for (metric, name), value in sorted(self.counters.items()):
+                attributes.setdefault(metric, {})[name] = value
+            for (metric, name), histogram in sorted(self.histograms.items()):
+                count, p95 = histogram.count, histogram.quantile(0.95)
+                attributes.setdefault(metric, {})[name] = {
+                    "count": count,
+                    "mean_ms": round(histogram.total / count * 1000, 3),
+                    "p95_ms": p95 * 1000 if p95 in BUCKETS else None  # None: Beyond the largest bucket
+                }
+            return attributes
+
+    def as_prometheus(self):
+        """Returns the metrics in the Prometheus text exposition format."""
+        def labels(name, **extra):
+            pairs = [("app", self.app), ("name", name)] + sorted(extra.items())
+            return ",".join('{}="{}"'.format(k, str(v).replace('"', '\\"')) for k, v in pairs)
+
+        lines = []
+        with self._lock:
+            for metric in sorted({metric for metric, _ in self.counters}):
+                lines.append("# TYPE appdaemon_{metric} counter".format(**locals()))
+                lines.extend(
+                    "appdaemon_{}{{{}}} {}".format(metric, labels(name), value)
+                    for (m, name), value in sorted(self.counters.items()) if m == metric
+                )
+            for metric in sorted({metric for metric, _ in self.histograms}):
+                lines.append("# TYPE appdaemon_{metric} histogram".format(**locals()))
+                for (m, name), histogram in sorted(self.histograms.items()):
+                    if m != metric:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(BUCKETS + ("+Inf",), histogram.counts):
+                        cumulative += count
+                        lines.append("appdaemon_{}_bucket{{{}}} {}".format(metric, labels(name, le=bound), cumulative))
+                    lines.append("appdaemon_{}_sum{{{}}} {}".format(metric, labels(name), histogram.total))
+                    lines.append("appdaemon_{}_count{{{}}} {}".format(metric, labels(name), cumulative))
+        return "\n".join(lines) + "\n"
+
+
+def timed(name):
+    """
+    Decorates a method of an app to record its latency as `name` - if the app has instrumentation turned on (the app
+    has `metrics`).
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            metrics = self.metrics
+            if metrics is None:
+                return func(self, *args, **kwargs)
+            with metrics.time(name):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _counting(metrics, func, name):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        metrics.inc("hass_calls_total", name)
+        return func(*args, **kwargs)
+    return wrapper
+
+
+def _instrumented_callback(metrics, callback, is_timer):
+    name = getattr(callback, "__name__", repr(callback))
+
+    @functools.wraps(callback)
+    def wrapper(*args, **kwargs):
+        if is_timer:
+            metrics.inc("timer_fires_total", name)
+        with metrics.time(name):
+            return callback(*args, **kwargs)
+    return wrapper
+
+
+def _registering(metrics, func, is_timer):
+    @functools.wraps(func)
+    def wrapper(callback, *args, **kwargs):
+        return func(_instrumented_callback(metrics, callback, is_timer), *args, **kwargs)
+    return wrapper
+
+
+def setup(hass, cfg):
+    """
+    Turns instrumentation on for the given app if `cfg` (the `metrics` node of the app args) is set. Call it first
+    thing in `initialize` so every callback registered afterwards is measured.
+
+    The hass api methods of the app instance are shadowed by counting / measuring wrappers. Nothing is touched if
+    instrumentation is off.
+
+    Args:
+        hass: The app.
+        cfg: The `metrics` node of the app args (None turns instrumentation off).
+
+    Returns:
+        Returns the `Metrics` of the app or None if instrumentation is off.
+    """
+    if cfg is None:
+        return None
+    cfg = SCHEMA(cfg)
+    metrics = Metrics(app=hass.name)
+    sensor = cfg["sensor"] or "sensor.{}_metrics".format(hass.name)
+    set_state, run_every = hass.set_state, hass.run_every  # Publishing is no work of the app: Not counted
+
+    def publish(kwargs):
+        attributes = metrics.as_attributes()
+        calls = sum(attributes.get("hass_calls_total", {}).values())
+        set_state(entity_id=sensor, state=calls, attributes=attributes)
+        if cfg["prometheus"]:
+            try:
+                utils.atomic_write(cfg["prometheus"], metrics.as_prometheus().encode())
+            except OSError as e:
+                hass.log("Could not write the metrics to '{}': {}".format(cfg["prometheus"], e), level="WARNING")
+
+    for name in COUNTED_CALLS:
+        setattr(hass, name, _counting(metrics, getattr(hass, name), name))
+    for name in CALLBACK_REGISTRATIONS:
+        if hasattr(hass, name):
+            setattr(hass, name, _registering(metrics, getattr(hass, name), name in TIMER_REGISTRATIONS))
+    run_every(publish, hass.datetime() + datetime.timedelta(seconds=cfg["interval"]), cfg["interval"])
+    return metrics
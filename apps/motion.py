@@ -1,13 +1,23 @@
 import attr
+import datetime
 from enum import Enum
+import math
+import time
 
 import appdaemon.plugins.hass.hassapi as hass
 
+import instrumentation
 import utils
 
 
 __VERSION__ = "0.3.3"
 
+GAP_BUCKETS = tuple(int(5 * 1.25 ** i) for i in range(40))  # Seconds: 5s ... ~8h
+GAP_DECAY = 0.98  # Per retrigger: The last ~50 retriggers dominate the learned delay
+ADAPTIVE_MIN_SAMPLES = 10  # Use the configured delay until there were that many retriggers ...
+ADAPTIVE_MIN_WEIGHT = (1 - GAP_DECAY ** ADAPTIVE_MIN_SAMPLES) / (1 - GAP_DECAY)  # ... which weigh that much
+ADAPTIVE_SAVE_INTERVAL = 15 * 60  # Seconds between persisting the learned retrigger gaps
+
 
 class Op(Enum):
     Below = "below"
@@ -29,34 +39,48 @@ class Op(Enum):
 class Light:
     entity = attr.ib(type=str)
     hass = attr.ib()
+    state = attr.ib(type=str, init=False, default=None)  # Last known state, kept up to date by a listener
 
-    @classmethod
-    def from_config(cls, cfg, hass):
-        return [cls(entity=item, hass=hass) for item in cfg['lights']]
-
-    def turn_on(self):
-        self.hass.log("Turning on {self.entity}".format(**locals()))
-        self.hass.turn_on(entity_id=self.entity)
+    def subscribe(self, state):
+        """Starts with the given state and tracks the state of the light on every state change."""
+        self.state = state
+        self.hass.listen_state(self._on_change, self.entity)
 
-    def turn_off(self):
-        self.hass.log("Turning off {self.entity}".format(**locals()))
-        self.hass.turn_off(entity_id=self.entity)
+    def _on_change(self, entity, attribute, old, new, kwargs):
+        self.state = new
 
 
 @attr.s
-class Motion:
-    entity = attr.ib(type=str)
+class LightGroup:
+    """
+    Switches all lights with a single service call. Lights that are known to be in the target state already are
+    skipped - a call is only made if there is at least one light left.
+    """
+    lights = attr.ib(type=list)
     hass = attr.ib()
 
     @classmethod
-    def from_config(cls, cfg, hass):
-        return [cls(entity=item, hass=hass) for item in cfg['motion']]
+    def from_config(cls, cfg, hass, registry):
+        """Lights shared by several zones are the same `Light` (see `registry`: entity -> light)."""
+        lights = [registry.setdefault(item, Light(entity=item, hass=hass)) for item in cfg['lights']]
+        return cls(lights=lights, hass=hass)
+
+    def turn_on(self):
+        self._switch("on")
 
-    def on_motion(self, callback):
-        self.hass.listen_state(callback, self.entity, new="on")
+    def turn_off(self):
+        self._switch("off")
 
-    def on_motion_off(self, callback):
-        self.hass.listen_state(callback, self.entity, old='on', new='off')
+    def _switch(self, state):
+        pending = [light for light in self.lights if light.state != state]
+        if not pending:
+            self.hass.logger.debug("Lights are {} already", state)
+            return
+        entities = [light.entity for light in pending]
+        self.hass.logger.info("Turning {} {}", state, entities)
+        self.hass.call_service("homeassistant/turn_{}".format(state), entity_id=entities)
+        for light in pending:
+            light.state = state  # Optimistic: Retriggers until home assistant reports back won't call again
 
 
 @attr.s
@@ -65,38 +89,104 @@ class Sensor:
     op = attr.ib(type=str)
     value = attr.ib(type=(int, float))
     hass = attr.ib()
+    current = attr.ib(type=float, init=False, default=None)  # Parsed state, kept up to date by the app
 
     @classmethod
     def from_config(cls, cfg, hass):
         return [cls(entity=item['entity'], op=item['op'], value=item['value'], hass=hass) for item in cfg['sensor']]
 
-    def current(self):
-        val = self.hass.get_state(entity=self.entity)
-        return float(val) if val else None
-
     def is_within_limits(self):
-        curval = self.current()
-        if not curval:
+        curval = self.current
+        if curval is None:
             return False  # Device is unknown or error
 
         if self.op is Op.Below:
             res = curval < self.value
-            self.hass.log("Limit check: {curval} < {self.value} = {res}".format(**locals()))
+            self.hass.logger.debug("Limit check: {} < {} = {}", curval, self.value, res)
             return res
         if self.op is Op.Above:
             res = curval > self.value
-            self.hass.log("Limit check: {curval} > {self.value} = {res}".format(**locals()))
+            self.hass.logger.debug("Limit check: {} > {} = {}", curval, self.value, res)
             return res
         if self.op is Op.Equals:
-            import math
             res = math.isclose(curval, self.value)
-            self.hass.log("Limit check: {curval} > {self.value} = {res}".format(**locals()))
+            self.hass.logger.debug("Limit check: {} == {} = {}", curval, self.value, res)
             return res
         return True
 
 
+@attr.s
+class AdaptiveDelay:
+    """
+    Learns the off delay of a zone from the gaps between motion being off and motion being detected again
+    (retriggers). The delay is the given percentile of the recent gaps, so the lights stay on through the usual
+    pauses of a busy room but go off quickly in a room one only passes through. Gaps longer than `max` are no
+    retriggers: The room was left.
+    """
+    percentile = attr.ib(type=float)
+    min = attr.ib(type=int)
+    max = attr.ib(type=int)
+    gaps = attr.ib(type=utils.DecayingHistogram, default=attr.Factory(
+        lambda: utils.DecayingHistogram(bounds=GAP_BUCKETS, decay=GAP_DECAY)
+    ))
+    _last_off = attr.ib(init=False, default=None)
+
+    @classmethod
+    def from_config(cls, cfg):
+        return cls(percentile=cfg['percentile'], min=cfg['min'], max=cfg['max'])
+
+    def motion_off(self, dt):
+        self._last_off = dt
+
+    def motion_on(self, dt):
+        """Returns True if the motion is a retrigger that was learned."""
+        last_off, self._last_off = self._last_off, None
+        if last_off is None:
+            return False
+        gap = (dt - last_off).total_seconds()
+        if gap > self.max:
+            return False
+        self.gaps.observe(gap)
+        return True
+
+    def delay(self, default):
+        if self.gaps.weight < ADAPTIVE_MIN_WEIGHT - 1e-9:
+            return default  # Not enough retriggers (recently) to tell
+        learned = self.gaps.quantile(self.percentile / 100)
+        return min(max(self.min, learned if learned is not None else self.max), self.max)
+
+
+@attr.s
+class Zone:
+    """Lights that are turned on by motion in the zone (if the sensors are within their limits)."""
+    name = attr.ib(type=str)
+    lights = attr.ib(type=LightGroup)
+    motion = attr.ib(type=list)
+    sensors = attr.ib(type=list)
+    delay = attr.ib(type=int)  # Turn off the lights this many seconds after motion is off
+    adaptive = attr.ib(type=AdaptiveDelay, default=None)  # Learns the delay instead
+
+    @classmethod
+    def from_config(cls, name, cfg, hass, lights, delay, adaptive):
+        adaptive = cfg.get('adaptive', adaptive)
+        return cls(
+            name=name,
+            lights=LightGroup.from_config(cfg, hass, lights),
+            motion=cfg['motion'],
+            sensors=Sensor.from_config(cfg, hass),
+            delay=cfg.get('for', delay),
+            adaptive=AdaptiveDelay.from_config(adaptive) if adaptive else None
+        )
+
+    def is_within_limits(self):
+        return all(sensor.is_within_limits() for sensor in self.sensors)
+
+    def off_delay(self):
+        return self.adaptive.delay(self.delay) if self.adaptive else self.delay
+
+
 class Validator:
-    from voluptuous import Schema, Required, Optional, Range, All, Or, And
+    from voluptuous import Schema, Required, Optional, Range, All, Or, And, Invalid
 
     SENSOR_SCHEMA = Schema({
         Required("entity"): str,
@@ -104,51 +194,151 @@ class Validator:
         Required("value"): Or(float, int)
     })
 
-    SCHEMA = Schema({
-        Optional("for", default="5m"): utils.parse_duration_literal,  # Lights on for x seconds
+    ADAPTIVE_SCHEMA = Schema({
+        Optional("percentile", default=90): All(Or(float, int), Range(min=1, max=100)),
+        Optional("min", default="1m"): utils.parse_duration_literal,
+        Optional("max", default="30m"): utils.parse_duration_literal
+    })
+
+    ZONE_SCHEMA = Schema({
+        Optional("for"): utils.parse_duration_literal,  # Default: The `for` of the app
+        Optional("adaptive"): Or(None, ADAPTIVE_SCHEMA),  # Default: The `adaptive` of the app
         Required("lights"): Or([str], lambda v: [v] if isinstance(v, str) else []),
         Required("motion"): Or([str], lambda v: [v] if isinstance(v, str) else []),
         Optional("sensor", default=[]): Or([SENSOR_SCHEMA], lambda v: [Validator.SENSOR_SCHEMA(v)])
+    })
+
+    SCHEMA = Schema({
+        Optional("for", default="5m"): utils.parse_duration_literal,  # Lights on for x seconds
+        Optional("adaptive", default=None): Or(None, ADAPTIVE_SCHEMA),  # Learn the delay instead
+        Optional("lights"): Or([str], lambda v: [v] if isinstance(v, str) else []),
+        Optional("motion"): Or([str], lambda v: [v] if isinstance(v, str) else []),
+        Optional("sensor", default=[]): Or([SENSOR_SCHEMA], lambda v: [Validator.SENSOR_SCHEMA(v)]),
+        Optional("zones", default={}): {str: ZONE_SCHEMA},
+        Optional("storage_dir", default=None): Or(None, str),
+        Optional("log_level", default="INFO"): utils.parse_log_level
     }, extra=True)
 
     @classmethod
     def validate(cls, dct):
-        return cls.SCHEMA(dct)
+        cfg = cls.SCHEMA(dct)
+        if ("lights" in cfg) != ("motion" in cfg):
+            raise cls.Invalid("Either configure both 'lights' and 'motion' or none of them")
+        if "lights" not in cfg and not cfg["zones"]:
+            raise cls.Invalid("Configure 'lights' and 'motion' or at least one zone in 'zones'")
+        return cfg
 
 
 class App(hass.Hass):
+    """
+    Turns on lights on motion. One app instance serves any number of zones (`zones`) - the top level `lights`,
+    `motion` and `sensor` form a zone named after the app. Entities shared by several zones are tracked once and
+    the off delays of all zones share a single timer.
+    """
+    metrics = None  # Instrumentation is off
+    _adaptive_dirty = False  # Learned off delays not saved yet
+
     def initialize(self):
         self.log("Motion App @ {version}".format(version=__VERSION__))
-        cfg = Validator.validate(self.args)
-
-        self._lights = Light.from_config(cfg, self)
-        self._motion = Motion.from_config(cfg, self)
-        self._sensor = Sensor.from_config(cfg, self)
-        self._for = cfg['for']
-        self._timer = None
-
-        for motion in self._motion:
-            motion.on_motion(self._on_motion)
-            motion.on_motion_off(self._on_motion_off)
+        self.metrics = instrumentation.setup(self, self.args.get("metrics"))
+        cfg = utils.cached_config(
+            self.args, Validator.validate, source=__file__, name=self.name, storage_dir=self.args.get("storage_dir")
+        )
+        self.logger = utils.Logger(self.log, cfg['log_level'])
+
+        lights = {}  # entity -> light
+        zones = dict(cfg['zones'])
+        if "lights" in cfg:
+            zones[self.name] = cfg
+        self._zones = {
+            name: Zone.from_config(name, zcfg, self, lights, cfg['for'], cfg['adaptive'])
+            for name, zcfg in sorted(zones.items())
+        }
+        self._motion_index = {}  # motion entity -> zones
+        self._sensor_index = {}  # sensor entity -> sensors (of all zones)
+        for zone in self._zones.values():
+            for entity in zone.motion:
+                self._motion_index.setdefault(entity, []).append(zone)
+            for sensor in zone.sensors:
+                self._sensor_index.setdefault(sensor.entity, []).append(sensor)
+        self._timers = utils.TimerHeap(self, self._on_turn_off_after_delay)
+
+        self._adaptive_path = utils.storage_path(cfg['storage_dir'], "{}-motion.json".format(self.name))
+        adaptive = [zone for zone in self._zones.values() if zone.adaptive]
+        learned = utils.load_json(self._adaptive_path, {})  # Learned before the restart
+        for zone in adaptive:
+            gaps = learned.get(zone.name)
+            if gaps and gaps["bounds"] == list(GAP_BUCKETS) and len(gaps["counts"]) == len(GAP_BUCKETS) + 1:
+                zone.adaptive.gaps = utils.DecayingHistogram.from_dict(gaps)
+        if adaptive:
+            self.run_every(
+                self._on_save_adaptive,
+                self.datetime() + datetime.timedelta(seconds=ADAPTIVE_SAVE_INTERVAL),
+                ADAPTIVE_SAVE_INTERVAL
+            )
+
+        states = self.get_state()  # All initial states with a single read
+        for light in lights.values():
+            light.subscribe((states.get(light.entity) or {}).get("state"))
+        for entity in self._sensor_index:  # Limit checks are served from memory
+            self._set_sensor_value(entity, (states.get(entity) or {}).get("state"))
+            self.listen_state(self._on_sensor_change, entity)
+        for entity in self._motion_index:
+            self.listen_state(self._on_motion, entity, new="on")
+            self.listen_state(self._on_motion_off, entity, old='on', new='off')
+        self.logger.info("Tracking {} zones with {} motion sensors and {} lights",
+                         len(self._zones), len(self._motion_index), len(lights))
+
+    def _set_sensor_value(self, entity, value):
+        value = utils.try_parse_float(value)
+        for sensor in self._sensor_index[entity]:
+            sensor.current = value
+
+    def _on_sensor_change(self, entity, attribute, old, new, kwargs):
+        self._set_sensor_value(entity, new)
 
     def _on_motion(self, entity, attribute, old, new, kwargs):
-        self.log("Motion detected @ {entity}: {old} -> {new}".format(**locals()))
-        for sensor in self._sensor:
-            if not sensor.is_within_limits():
-                return
-        for light in self._lights:
-            light.turn_on()
-        self._safe_cancel_timer()
+        start = time.perf_counter()
+        self.logger.info("Motion detected @ {}: {} -> {}", entity, old, new)
+        for zone in self._motion_index[entity]:
+            if zone.adaptive and zone.adaptive.motion_on(self.datetime()):
+                self._adaptive_dirty = True
+            if not zone.is_within_limits():
+                continue
+            zone.lights.turn_on()
+            self._record_latency(entity, time.perf_counter() - start)
+            self._timers.cancel(zone.name)
+
+    def _record_latency(self, entity, latency):
+        """Records the time it took from the motion event until the lights were turned on."""
+        self.logger.debug("Turned on the lights {:.1f}ms after motion @ {}", latency * 1000, entity)
+        if self.metrics is not None:
+            self.metrics.observe("motion_to_turn_on_seconds", entity, latency)
 
     def _on_motion_off(self, entity, attribute, old, new, kwargs):
-        self.log("Motion off @ {entity}: {old} -> {new}".format(**locals()))
-        self._safe_cancel_timer()
-        self._timer = self.run_in(self._on_turn_off_after_delay, self._for)
-
-    def _on_turn_off_after_delay(self, kwargs):
-        for light in self._lights:
-            light.turn_off()
-
-    def _safe_cancel_timer(self):
-        if self._timer:
-            self.cancel_timer(self._timer)
+        self.logger.info("Motion off @ {}: {} -> {}", entity, old, new)
+        for zone in self._motion_index[entity]:
+            if zone.adaptive:
+                zone.adaptive.motion_off(self.datetime())
+            delay = zone.off_delay()
+            self.logger.debug("Turning off the lights of zone '{}' in {} seconds", zone.name, delay)
+            self._timers.schedule(zone.name, delay)
+
+    def _on_turn_off_after_delay(self, zone_name, payload):
+        self._zones[zone_name].lights.turn_off()
+
+    def _on_save_adaptive(self, kwargs):
+        self._save_adaptive()
+
+    def _save_adaptive(self):
+        if not self._adaptive_dirty:
+            return
+        learned = {zone.name: zone.adaptive.gaps.to_dict() for zone in self._zones.values() if zone.adaptive}
+        try:
+            utils.save_json(self._adaptive_path, learned)
+            self._adaptive_dirty = False
+        except OSError as e:
+            self.logger.warning("Could not save the learned off delays to '{}': {}", self._adaptive_path, e)
+
+    def terminate(self):
+        self._save_adaptive()
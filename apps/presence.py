@@ -1,13 +1,19 @@
+import attr
+import datetime
 from enum import Enum
-import time
+import threading
 
 import appdaemon.plugins.hass.hassapi as hass
 
+import instrumentation
 import utils
 
 
 __VERSION__ = "0.3.3"
 
+SAVE_DELAY = 5  # Seconds: The pending transitions are saved once for a burst of changes
+OPTIONS_TIMEOUT = 10  # Seconds to wait for home assistant to confirm the state options
+
 
 # Mapping
 # Init the options of select_option
@@ -44,132 +50,458 @@ class TrackerState(Enum):
     def from_str(label):
         if not isinstance(label, str):
             raise TypeError("Argument 'label' is expected to be a str")
-        for s in TrackerState:
-            if label == s.value:
-                return s
-        raise ValueError("Argument label '{label}' is expected to be valid state, but is not".format(**locals()))
+        state = TRACKER_STATES.get(label)
+        if state is None:
+            raise ValueError("Argument label '{label}' is expected to be valid state, but is not".format(**locals()))
+        return state
+
+
+TRACKER_STATES = {state.value: state for state in TrackerState}  # Interned hass states of a device tracker
+UNAVAILABLE_STATES = (None, "unavailable", "unknown")  # The tracker does not know: Its last known state is kept
+
+# The state a person transits to when the (fused) tracker state changes. None: The state stays as it is
+TRANSITIONS = {
+    (State.Home, TrackerState.Home): None,
+    (State.JustArrived, TrackerState.Home): None,
+    (State.JustLeft, TrackerState.Home): State.Home,  # Prevent oscillating when tracking was lost
+    (State.Away, TrackerState.Home): State.JustArrived,
+    (State.ExtendedAway, TrackerState.Home): State.JustArrived,
+    (State.Home, TrackerState.NotHome): State.JustLeft,
+    (State.JustArrived, TrackerState.NotHome): State.JustLeft,
+    (State.JustLeft, TrackerState.NotHome): None,
+    (State.Away, TrackerState.NotHome): None,
+    (State.ExtendedAway, TrackerState.NotHome): None
+}
+
+# The state to restore on startup given the state in hass: It has to be consistent with the tracker state
+RESTORES = {
+    (State.Home, TrackerState.Home): State.Home,
+    (State.JustArrived, TrackerState.Home): State.JustArrived,
+    (State.JustLeft, TrackerState.Home): State.Home,
+    (State.Away, TrackerState.Home): State.Home,
+    (State.ExtendedAway, TrackerState.Home): State.Home,
+    (State.Home, TrackerState.NotHome): State.Away,
+    (State.JustArrived, TrackerState.NotHome): State.Away,
+    (State.JustLeft, TrackerState.NotHome): State.JustLeft,
+    (State.Away, TrackerState.NotHome): State.Away,
+    (State.ExtendedAway, TrackerState.NotHome): State.ExtendedAway
+}
+
+
+class Fusion(Enum):
+    """How the states of several device trackers of a person are fused into one."""
+    Any = "any"  # Home if any tracker is home
+    All = "all"  # Home if all trackers are home
+    Weighted = "weighted"  # Home if the weight of the trackers at home reaches the threshold
+
+    @classmethod
+    def from_str(cls, candidate):
+        if not isinstance(candidate, str):
+            raise TypeError("Argument 'candidate' is expected to be a str")
+        policies = {policy.value: policy for policy in cls}
+        val = policies.get(candidate)
+        if not val:
+            raise ValueError("Argument 'candidate' should be one of {}".format(list(policies)))
+        return val
+
+
+@attr.s
+class Person:
+    """The extended presence state of a person (`state` entity) derived from one or more device trackers."""
+    name = attr.ib(type=str)
+    trackers = attr.ib(type=list)
+    state_entity = attr.ib(type=str)
+    map = attr.ib(type=dict)  # State to hass
+    imap = attr.ib(type=dict)  # hass to state
+    follow_ups = attr.ib(type=dict)  # State -> (delay, State to transit to after the delay)
+    init_options = attr.ib(type=bool, default=False)
+    fusion = attr.ib(type=Fusion, default=Fusion.Any)
+    weights = attr.ib(type=dict, default=attr.Factory(dict))  # tracker -> weight (Fusion.Weighted). Default: 1
+    threshold = attr.ib(type=float, default=0.5)  # Share of the total weight that has to be home (Fusion.Weighted)
+    debounce = attr.ib(type=int, default=0)  # Seconds the fused tracker state has to be stable before it is applied
+    table = attr.ib(type=dict, init=False)  # (State, TrackerState) -> (State, follow up) / None. See `TRANSITIONS`
+    current_state = attr.ib(type=State, init=False, default=None)
+    tracker_states = attr.ib(type=dict, init=False, default=attr.Factory(dict))  # tracker -> last known TrackerState
+    tracker_state = attr.ib(type=TrackerState, init=False, default=None)  # The fused state `current_state` follows
+
+    @classmethod
+    def from_config(cls, name, cfg, defaults):
+        """Options not configured for the person (`cfg`) are taken from the app (`defaults`)."""
+        def opt(key):
+            return cfg[key] if key in cfg else defaults[key]
+
+        user_map = {State.from_str(k): v for k, v in opt('map').items()}
+        state_map = {state: user_map.get(state, state.value) for state in State}
+        trackers = cfg['tracker']
+        return cls(
+            name=name,
+            trackers=[trackers] if isinstance(trackers, str) else list(trackers),
+            state_entity=cfg['state'],
+            map=state_map,
+            imap={v: k for k, v in state_map.items()},
+            follow_ups={
+                State.JustArrived: (opt('just_arrived_delay'), State.Home),
+                State.JustLeft: (opt('just_left_delay'), State.Away),
+                State.Away: (opt('extended_away_delay'), State.ExtendedAway)
+            },
+            init_options=opt('init_options'),
+            fusion=opt('fusion'),
+            weights=opt('weights'),
+            threshold=opt('threshold'),
+            debounce=opt('debounce')
+        )
+
+    @table.default
+    def _compile(self):
+        return {
+            key: None if state is None else (state, self.follow_ups.get(state))
+            for key, state in TRANSITIONS.items()
+        }
+
+    def fuse(self):
+        """Fuses the last known states of all trackers into a single one."""
+        homes = [self.tracker_states.get(tracker) is TrackerState.Home for tracker in self.trackers]
+        if self.fusion is Fusion.Any:
+            home = any(homes)
+        elif self.fusion is Fusion.All:
+            home = all(homes)
+        else:
+            weights = [self.weights.get(tracker, 1.0) for tracker in self.trackers]
+            home = sum(w for w, h in zip(weights, homes) if h) >= self.threshold * sum(weights)
+        return TrackerState.Home if home else TrackerState.NotHome
+
+
+class Engine:
+    """
+    The presence state machine of all persons. It does not depend on hass, so it can be driven offline as well:
+    Tracker changes and due timers go in, state changes come out through `on_state`.
+
+    Args:
+        persons: The persons by name.
+        timers: The timers of the follow up transitions and the debounce windows (a `utils.TimerHeap` that calls
+            `on_timer`). Keyed by (kind, name of the person).
+        on_state: Called with the person and its new state on every state change.
+        logger: A `utils.Logger`.
+    """
+    def __init__(self, persons, timers, on_state, logger):
+        self.persons = persons
+        self.timers = timers
+        self.on_state = on_state
+        self.logger = logger
+        self.tracker_index = {}  # tracker entity -> persons
+        for person in persons.values():
+            for tracker in person.trackers:
+                self.tracker_index.setdefault(tracker, []).append(person)
+
+    def on_tracker(self, entity, new):
+        """Feeds the new hass state of the tracker `entity`."""
+        new_state = TRACKER_STATES.get(new) or self._tracker_state(entity, new)
+        if new_state is None:
+            return  # Nothing changes
+        for person in self.tracker_index[entity]:
+            person.tracker_states[entity] = new_state
+            fused = person.fuse()
+            debounce = ("debounce", person.name)
+            if fused is person.tracker_state:
+                if debounce in self.timers:
+                    self.logger.debug("Tracker state of '{}' is back to '{}' within the debounce window",
+                                      person.name, fused)
+                    self.timers.cancel(debounce)
+            elif not person.debounce:
+                self._transit(person, fused)
+            elif debounce not in self.timers:
+                self.timers.schedule(debounce, person.debounce)
+
+    def on_timer(self, key, payload):
+        kind, name = key
+        person = self.persons[name]
+        if kind == "debounce":
+            fused = person.fuse()
+            if fused is not person.tracker_state:
+                self._transit(person, fused)
+        else:
+            self.set_state(person, payload)
+
+    def restore(self, person, state, tracker_states, pending=None, now=None):
+        """
+        Restores the state of `person` on startup from its `state` and the hass states of its trackers.
+
+        `pending` is the follow up transition (due, next State) that was pending in `state` before a restart: It is
+        resumed instead of started over. Transitions that are overdue by `now` are caught up with right away.
+        """
+        for tracker in person.trackers:
+            new = tracker_states.get(tracker)
+            tracker_state = TRACKER_STATES.get(new) or self._tracker_state(tracker, new)
+            if tracker_state is not None:
+                person.tracker_states[tracker] = tracker_state
+        tracker_state = person.tracker_state = person.fuse()
+        restored = RESTORES[(state, tracker_state)]
+        if restored is not state:
+            self.logger.info("Current state '{}' is invalid with tracker state '{}'. Resetting to '{}'",
+                             state, tracker_state, restored)
+
+        follow_up = None  # Default: The one of the restored state
+        expected = person.follow_ups.get(state)
+        if pending is not None and restored is state and expected is not None and expected[1] is pending[1]:
+            while pending is not None and pending[0] <= now:  # Overdue: Catch up
+                due, restored = pending
+                step = person.follow_ups.get(restored)
+                pending = None if step is None else (due + datetime.timedelta(seconds=step[0]), step[1])
+            if pending is not None:
+                due, next_state = pending
+                follow_up = ((due - now).total_seconds(), next_state)
+                self.logger.info("Resumed the transition of '{}' to '{}' due at {}", person.name, next_state, due)
+        self.set_state(person, restored, follow_up)
+
+    def _tracker_state(self, entity, new):
+        """
+        Interns a hass state of a tracker that is neither `home` nor `not_home`: Any zone other than home counts as
+        not home. Returns None if the tracker is unavailable - a tracker without a known state counts as not home.
+        """
+        if new in UNAVAILABLE_STATES:
+            self.logger.warning("Tracker '{}' is '{}'. Keeping its last known state", entity, new)
+            return None
+        self.logger.debug("Tracker '{}' is in zone '{}'. Counting it as '{}'", entity, new, TrackerState.NotHome)
+        return TrackerState.NotHome
+
+    def pending_follow_ups(self):
+        """Returns the pending follow up transitions as name of the person -> (current State, due, next State)."""
+        return {
+            name: (self.persons[name].current_state, due, next_state)
+            for (kind, name), (due, next_state) in self.timers.pending().items() if kind == "follow_up"
+        }
+
+    def set_state(self, person, state, follow_up=None):
+        """Sets the state of `person` and schedules its follow up transition (Default: The one of the state)."""
+        self.on_state(person, state)
+        person.current_state = state
+
+        key = ("follow_up", person.name)
+        self.timers.cancel(key)  # Any scheduled state is outdated now
+        follow_up = follow_up or person.follow_ups.get(state)
+        if follow_up is not None:
+            delay, new_state = follow_up
+            self.timers.schedule(key, delay, payload=new_state)
+            self.logger.debug("Scheduled state '{}' for '{}' in {} seconds ({} active timers)",
+                              new_state, person.name, delay, len(self.timers))
+
+    def _transit(self, person, tracker_state):
+        person.tracker_state = tracker_state
+        step = person.table[(person.current_state, tracker_state)]
+        if step is not None:
+            self.set_state(person, *step)
 
 
 class Validator:
-    from voluptuous import Schema, Required, Optional, Range, All, Or
+    from voluptuous import Schema, Required, Optional, Range, All, And, Or, Length, Invalid
 
     T5_MINUTES = 5 * 60
     T24_HOURS = 24 * 60 * 60
 
-    SCHEMA = Schema({
-        Required('tracker'): str,
+    TRACKERS = Or(str, All([str], Length(min=1)))
+    WEIGHTS = {str: All(Or(float, int), Range(min=0))}
+    THRESHOLD = All(Or(float, int), Range(min=0, max=1))
+
+    PERSON_SCHEMA = Schema({  # Options not given are taken from the app
+        Required('tracker'): TRACKERS,
         Required('state'): str,
+        Optional('map'): {state.value: str for state in State},
+        Optional('just_left_delay'): utils.parse_duration_literal,
+        Optional('just_arrived_delay'): utils.parse_duration_literal,
+        Optional('extended_away_delay'): utils.parse_duration_literal,
+        Optional('init_options'): bool,
+        Optional('fusion'): And(str, Fusion.from_str),
+        Optional('weights'): WEIGHTS,
+        Optional('threshold'): THRESHOLD,
+        Optional('debounce'): utils.parse_duration_literal
+    })
+
+    SCHEMA = Schema({
+        Optional('tracker'): TRACKERS,
+        Optional('state'): str,
+        Optional('persons', default={}): {str: PERSON_SCHEMA},
         Optional('map', default={state.value: state.value for state in State}): {state.value: str for state in State},
         Optional('just_left_delay', default=T5_MINUTES): utils.parse_duration_literal,
         Optional('just_arrived_delay', default=T5_MINUTES): utils.parse_duration_literal,
-        Optional('extended_away_delay', default=T24_HOURS): utils.parse_duration_literal
+        Optional('extended_away_delay', default=T24_HOURS): utils.parse_duration_literal,
+        Optional('init_options', default=False): bool,
+        Optional('fusion', default="any"): And(str, Fusion.from_str),
+        Optional('weights', default={}): WEIGHTS,
+        Optional('threshold', default=0.5): THRESHOLD,
+        Optional('debounce', default=0): utils.parse_duration_literal,
+        Optional('storage_dir', default=None): Or(None, str),
+        Optional('log_level', default="INFO"): utils.parse_log_level
     }, extra=True)
 
     @classmethod
     def validate(cls, dct):
-        return cls.SCHEMA(dct)
+        cfg = cls.SCHEMA(dct)
+        if ('tracker' in cfg) != ('state' in cfg):
+            raise cls.Invalid("Either configure both 'tracker' and 'state' or none of them")
+        if 'tracker' not in cfg and not cfg['persons']:
+            raise cls.Invalid("Configure 'tracker' and 'state' or at least one person in 'persons'")
+        for name, person in [('app', cfg)] + sorted(cfg['persons'].items()):
+            trackers = person.get('tracker', [])
+            unknown = set(person.get('weights', {})) - set([trackers] if isinstance(trackers, str) else trackers)
+            if 'tracker' in person and unknown:
+                raise cls.Invalid("Weights of '{}' are given for unknown trackers: {}".format(name, sorted(unknown)))
+        return cfg
 
 
 class App(hass.Hass):
+    """
+    Derives the extended presence state of persons from their device trackers. One app instance serves any number
+    of persons (`persons`) - the top level `tracker` and `state` form a person named after the app. The delayed
+    transitions and the debounce windows of all persons share a single timer. The pending transitions are stored in
+    the `storage_dir` with their due time: A restart resumes them instead of starting them over.
+
+    A person may have several trackers: Their states are fused by the `fusion` policy. A change of the fused state is
+    only applied once it was stable for `debounce` seconds, so flapping trackers do not cause any state writes.
+    """
+    metrics = None  # Instrumentation is off
+    _engine = None  # Not initialized yet
+
     def initialize(self):
         self.log("Presence App @ {version}".format(version=__VERSION__))
+        self.metrics = instrumentation.setup(self, self.args.get("metrics"))
 
-        cfg = Validator.validate(self.args)
-
-        self._tracker_entity = cfg['tracker']
-        self._state_entity = cfg['state']
-        self._just_left_delay = cfg['just_left_delay']
-        self._just_arrived_delay = cfg['just_arrived_delay']
-        self._extended_away_delay = cfg['extended_away_delay']
-
-        user_map = cfg['map']
-        user_map = {State.from_str(k): v for k, v in user_map.items()}
-        self._map = {state: user_map.get(state, state.value) for state in State}  # State to hass
-        self._imap = {v: k for k, v in self._map.items()}  # hass to state
-
-        self.timer = None
-        self.current_state = None
-
-        if cfg.get('init_options', False):
-            self._set_options()
-            time.sleep(1)  # We have to wait after setting the mode - otherwise the read is "wrong"
-
-        self._init_current_state()
-
-        self.listen_state(self._on_tracker_change, self._tracker_entity)
+        cfg = utils.cached_config(
+            self.args, Validator.validate, source=__file__, name=self.name, storage_dir=self.args.get("storage_dir")
+        )
+        self.logger = utils.Logger(self.log, cfg['log_level'])
+
+        persons = dict(cfg['persons'])
+        if 'tracker' in cfg:
+            persons[self.name] = cfg
+        self._persons = {name: Person.from_config(name, pcfg, cfg) for name, pcfg in sorted(persons.items())}
+        self._timers = utils.TimerHeap(self, self._on_timer)  # Keyed by (kind, person)
+        self._engine = Engine(self._persons, self._timers, self._write_state, self.logger)
+        self._follow_ups_path = utils.storage_path(cfg['storage_dir'], "{}-presence.json".format(self.name))
+        self._saved_follow_ups = None
+        self._options_lock = threading.Lock()
+
+        updates = []
+        with_options = [person for person in self._persons.values() if person.init_options]
+        if with_options:
+            states = self.get_state()
+            updates = [update for update in (self._options_update(person, states) for person in with_options) if update]
+        self._options_pending = {person.state_entity for person, _, _ in updates}  # Not confirmed yet
+        for person, options, option in updates:
+            self._set_options(person, options, option)
+        if not updates:
+            self._start()  # Otherwise as soon as home assistant confirms the state options
+
+    def _start(self):
+        states = self.get_state()  # All initial states with a single read
+        pending = self._load_follow_ups()  # Pending before the restart
+        for person in self._persons.values():
+            self._init_current_state(person, states, pending.get(person.name))
+        self._save_follow_ups()
+
+        for tracker in self._engine.tracker_index:
+            self.listen_state(self._on_tracker_change, tracker)
+
+    def _on_options_ready(self, entity, confirmed):
+        if confirmed:
+            self.logger.info("State options of {} confirmed by home assistant", entity)
+        else:
+            self.logger.warning("State options of {} not confirmed within {} seconds", entity, OPTIONS_TIMEOUT)
+        with self._options_lock:  # The confirmations might arrive on different worker threads
+            self._options_pending.discard(entity)
+            ready = not self._options_pending
+        if ready:
+            self._start()
 
     def _on_tracker_change(self, entity, attribute, old, new, kwargs):
-        self.log("On tracker change: {old} -> {new}".format(**locals()))
-        old_state = TrackerState.from_str(old)
-        new_state = TrackerState.from_str(new)
-        if old_state == TrackerState.NotHome and new_state == TrackerState.Home:  # Mark person as just arrived
-            if self._current_state is State.JustLeft:
-                self._set_person_state(State.Home)  # Prevent oscillating when tracking was lost
-            else:
-                self._set_person_state(State.JustArrived)
-        if old_state == TrackerState.Home and new_state == TrackerState.NotHome:  # Mark person as just left
-            self._set_person_state(State.JustLeft)
-
-    def _on_scheduled_state_change(self, kwargs):
-        new_state = kwargs.pop('new_state')
-        self._set_person_state(new_state)
-
-    def _schedule_state_change(self, delay, new_state):
-        self.timer = self.run_in(self._on_scheduled_state_change, delay, new_state=new_state)
-
-    def _set_person_state(self, state):
-        self.log("Calling input_select/select_option for {self._state_entity} with {state}".format(**locals()))
+        self.logger.info("On tracker change @ {}: {} -> {}", entity, old, new)
+        self._engine.on_tracker(entity, new)
+
+    def _on_timer(self, key, payload):
+        if key == ("save", None):
+            self._save_follow_ups()
+        else:
+            self._engine.on_timer(key, payload)
+
+    def terminate(self):
+        if self._engine is not None:
+            self._save_follow_ups()
+
+    def _load_follow_ups(self):
+        pending = {}
+        for name, item in utils.load_json(self._follow_ups_path, {}).items():
+            try:
+                due = datetime.datetime.fromtimestamp(item['due'])
+                pending[name] = (State(item['state']), due, State(item['next']))
+            except (KeyError, TypeError, ValueError):
+                self.logger.warning("Ignoring the invalid pending transition of '{}': {}", name, item)
+        return pending
+
+    def _save_follow_ups(self):
+        follow_ups = {
+            name: {"state": state.value, "due": due.timestamp(), "next": next_state.value}
+            for name, (state, due, next_state) in self._engine.pending_follow_ups().items()
+        }
+        if follow_ups == self._saved_follow_ups:
+            return
+        try:
+            utils.save_json(self._follow_ups_path, follow_ups)
+            self._saved_follow_ups = follow_ups
+        except OSError as e:
+            self.logger.warning("Could not save the pending transitions to '{}': {}", self._follow_ups_path, e)
+
+    def _write_state(self, person, state):
+        self.logger.info("Calling input_select/select_option for {} with {}", person.state_entity, state)
         self.call_service(
             "input_select/select_option",
-            entity_id=self._state_entity,
-            option=self._map[state]
+            entity_id=person.state_entity,
+            option=person.map[state]
         )
-        self._current_state = state
-
-        if self.timer:
-            self.cancel_timer(self.timer)
-        if state == State.JustArrived:
-            self._schedule_state_change(self._just_arrived_delay, State.Home)  # Schedule Home in delay seconds
-        elif state == State.JustLeft:
-            self._schedule_state_change(self._just_left_delay, State.Away)  # Schedule Away in delay seconds
-        elif state == State.Away:
-            self._schedule_state_change(self._extended_away_delay, State.ExtendedAway)
-
-    def _init_current_state(self):
-        hass_state = self.get_state(entity=self._state_entity)
-        self.log("Current state in hass is {hass_state}".format(**locals()))
-        curstate = self._imap.get(hass_state)
+        if ("save", None) not in self._timers:
+            self._timers.schedule(("save", None), SAVE_DELAY)  # The follow up transitions changed
+
+    def _init_current_state(self, person, states, pending=None):
+        hass_state = (states.get(person.state_entity) or {}).get('state')
+        self.logger.info("Current state of '{}' in hass is {}", person.name, hass_state)
+        curstate = person.imap.get(hass_state)
         if curstate is None:
-            self.log("Current state in hass is invalid. Falling back to {}".format(State.Home))
-            curstate = State.Home
-        tracker_state = TrackerState.from_str(self.get_state(entity=self._tracker_entity))
-        if tracker_state is TrackerState.Home and curstate not in (State.JustArrived, State.Home):
-            self.log("Current state '{curstate}' is invalid with tracker state '{tracker_state}'. "
-                     "Resetting to home".format(**locals()))
+            self.logger.info("Current state in hass is invalid. Falling back to {}", State.Home)
             curstate = State.Home
-        elif tracker_state is TrackerState.NotHome and curstate not in (State.JustLeft, State.Away, State.ExtendedAway):
-            self.log("Current state '{curstate}' is invalid with tracker state '{tracker_state}'. "
-                     "Resetting to away".format(**locals()))
-            curstate = State.Away
-
-        self._set_person_state(state=curstate)
-
-    def _set_options(self):
-        curstate = self.get_state(entity=self._state_entity)
-        self.log("Current state is {curstate}".format(**locals()))
-        options = list(self._map.values())
-        self.log("Setting state options to {options}".format(**locals()))
+        tracker_states = {tracker: (states.get(tracker) or {}).get('state') for tracker in person.trackers}
+        resumed = None
+        if pending is not None:
+            state, due, next_state = pending
+            if state is curstate:  # Otherwise the state was changed while appdaemon was down
+                resumed = (due, next_state)
+        self._engine.restore(person, curstate, tracker_states, resumed, self.datetime())
+
+    def _options_update(self, person, states):
+        """Returns the (person, options, option to restore) if the state options of `person` have to be set."""
+        current = states.get(person.state_entity) or {}
+        curstate = current.get('state')
+        self.logger.info("Current state of '{}' is {}", person.name, curstate)
+        options = list(person.map.values())
 
+        if curstate not in options:
+            # The previous state of the mode entity is not longer a valid one - fallback
+            self.logger.info("Previous state is not longer valid - reverting to state = home")
+            curstate = person.map[State.Home]
+        if (current.get('attributes') or {}).get('options') == options and current.get('state') == curstate:
+            self.logger.info("State options of '{}' are already up to date", person.name)
+            return None
+        return person, options, curstate
+
+    def _set_options(self, person, options, curstate):
+        # Continue as soon as home assistant reports the restored state (listen before calling the services)
+        utils.StateAwaiter(
+            self, person.state_entity, self._on_options_ready, state=curstate, attributes={"options": options},
+            timeout=OPTIONS_TIMEOUT
+        )
+        self.logger.info("Setting state options to {}", options)
         self.call_service(
             "input_select/set_options",
-            entity_id=self._state_entity,
+            entity_id=person.state_entity,
             options=options
         )
-
-        if curstate not in options:
-            # The previous state of the mode entity is not longer a valid one - fallback
-            self.log("Previous state is not longer valid - reverting to state = home")
-            curstate = self._map[State.Home]
         # Restore the previous state if possible
-        self.log("Restoring state to {curstate}".format(**locals()))
-        self._set_person_state(self._imap[curstate])
+        self.logger.info("Restoring state to {}", curstate)
+        self.call_service("input_select/select_option", entity_id=person.state_entity, option=curstate)
@@ -1,4 +1,21 @@
+import bisect
+import datetime
+import hashlib
+import heapq
+import itertools
+import json
+import math
+import os
+import pickle
 import re
+import stat
+import tempfile
+import threading
+
+
+# Next to the apps in the appdaemon config dir: Owned by appdaemon, unlike a directory in the shared temp dir
+DEFAULT_STORAGE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".appdaemon-apps")
+LOG_LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40, "CRITICAL": 50}
 
 
 def try_parse_int(candidate):
@@ -27,6 +44,30 @@ def try_parse_int(candidate):
         return None
 
 
+def try_parse_float(candidate):
+    """
+    Convert the given candidate to float. If it fails None is returned.
+
+    Example:
+
+        >>> try_parse_float("12.5")
+        12.5
+        >>> print(try_parse_float("unavailable"))
+        None
+
+    Args:
+        candidate: The candidate to convert.
+
+    Returns:
+        Returns the converted candidate if convertible; otherwise None.
+
+    """
+    try:
+        return float(candidate)
+    except (ValueError, TypeError):
+        return None
+
+
 def parse_duration_literal(literal):
     """
     Converts duration literals as '1m', '1h', and so on to an actual duration in seconds.
@@ -73,3 +114,418 @@ def parse_duration_literal(literal):
         if value is None or unit not in seconds_per_unit:
             raise TypeError("Interval '{}' is not a valid literal".format(literal))
         return value * seconds_per_unit[unit]
+
+
+def parse_log_level(literal):
+    """
+    Converts a log level literal to its canonical (upper case) name.
+
+    Examples:
+
+        >>> parse_log_level('debug')
+        'DEBUG'
+        >>> parse_log_level('Warning')
+        'WARNING'
+        >>> parse_log_level('verbose')
+        Traceback (most recent call last):
+        ...
+        ValueError: Log level 'verbose' is not one of ['CRITICAL', 'DEBUG', 'ERROR', 'INFO', 'WARNING']
+
+    Args:
+        literal: Literal to parse.
+
+    Returns:
+        Returns the name of the log level. If the literal is not a log level an exception is raised.
+    """
+    level = str(literal).upper()
+    if level not in LOG_LEVELS:
+        raise ValueError("Log level '{}' is not one of {}".format(literal, sorted(LOG_LEVELS)))
+    return level
+
+
+class Logger:
+    """
+    Logs through the `log` function of an app. Messages below the configured level are dropped before they are
+    formatted: Pass the arguments of a message instead of formatting it yourself.
+
+    Example:
+
+        >>> logger = Logger(lambda msg, level: print(level, msg), "INFO")
+        >>> logger.debug("Not even formatted: {}", object())
+        >>> logger.info("Motion detected @ {entity}", entity="binary_sensor.motion")
+        INFO Motion detected @ binary_sensor.motion
+        >>> logger.is_enabled_for("DEBUG")
+        False
+
+    Args:
+        log: The log function of the app (takes the message and a `level`).
+        level: Messages below this level are dropped. Default: INFO.
+    """
+    __slots__ = ('_log', 'level', 'threshold')
+
+    def __init__(self, log, level="INFO"):
+        self._log = log
+        self.level = level
+        self.threshold = LOG_LEVELS[level]
+
+    def is_enabled_for(self, level):
+        return LOG_LEVELS[level] >= self.threshold
+
+    def log(self, level, msg, *args, **kwargs):
+        if LOG_LEVELS[level] >= self.threshold:
+            self._log(msg.format(*args, **kwargs) if args or kwargs else msg, level=level)
+
+    def debug(self, msg, *args, **kwargs):
+        if self.threshold <= 10:
+            self._log(msg.format(*args, **kwargs) if args or kwargs else msg, level="DEBUG")
+
+    def info(self, msg, *args, **kwargs):
+        if self.threshold <= 20:
+            self._log(msg.format(*args, **kwargs) if args or kwargs else msg, level="INFO")
+
+    def warning(self, msg, *args, **kwargs):
+        if self.threshold <= 30:
+            self._log(msg.format(*args, **kwargs) if args or kwargs else msg, level="WARNING")
+
+    def error(self, msg, *args, **kwargs):
+        if self.threshold <= 40:
+            self._log(msg.format(*args, **kwargs) if args or kwargs else msg, level="ERROR")
+
+
+def atomic_write(path, data):
+    """
+    Writes the given bytes to `path` atomically: Readers either see the previous content or the new one, but never
+    a partially written file.
+
+    Args:
+        path: The file to write.
+        data: The bytes to write.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(data)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp_path, path)
+    except:  # pylint: disable=broad-except
+        os.remove(tmp_path)
+        raise
+
+
+def is_private(path):
+    """
+    Returns True if `path` is owned by the current user and neither group nor world writable: Nobody else could have
+    planted or altered it.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    if hasattr(os, "getuid") and st.st_uid != os.getuid():
+        return False
+    return not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+
+def cached_config(args, build, source, name, storage_dir=None):
+    """
+    Returns the config built by `build(args)`. The built config is cached on disk in a binary form (pickle). The cache
+    key is a hash of the app `args`, the content of the module `source` and of this module (validation depends on
+    both). Unchanged args therefore skip validation and construction entirely on the next start, while any change to
+    the args or the code builds the config anew.
+
+    Loading a pickle runs code: The cache is only used if the storage directory and the cache file are private (see
+    `is_private`).
+
+    Args:
+        args: The app args to build the config from.
+        build: Callable that validates the args and builds the config.
+        source: Path of the module that defines the config (usually `__file__`).
+        name: Name of the app. There is one cache file per app.
+        storage_dir: Directory to store the cache in. Defaults to `DEFAULT_STORAGE_DIR`.
+
+    Returns:
+        Returns the built config.
+    """
+    try:
+        payload = json.dumps(args, sort_keys=True, default=str).encode()
+    except TypeError:
+        return build(args)  # Not hashable in a stable way
+    digest = hashlib.sha1(payload)
+    for module in (source, __file__):
+        with open(module, 'rb') as fp:
+            digest.update(fp.read())
+    path = storage_path(storage_dir, "{}-{}.config.pickle".format(name, digest.hexdigest()))
+    directory = os.path.dirname(path)
+    if os.path.isdir(directory) and not is_private(directory):
+        return build(args)  # Anybody could plant a cache in there
+    try:
+        if is_private(path):
+            with open(path, 'rb') as fp:
+                return pickle.load(fp)
+    except:  # pylint: disable=broad-except
+        pass  # Not readable: Build it
+    config = build(args)
+    try:
+        atomic_write(path, pickle.dumps(config, pickle.HIGHEST_PROTOCOL))
+        # Remove caches of former args. Exactly the ones of this app: `name` might be a prefix of another app
+        pattern = re.compile(re.escape(name) + r"-[0-9a-f]{40}\.config\.pickle")
+        for candidate in os.listdir(directory):
+            if pattern.fullmatch(candidate) and candidate != os.path.basename(path):
+                os.remove(os.path.join(directory, candidate))
+    except (OSError, pickle.PicklingError, TypeError, AttributeError):
+        pass  # Caching is best effort
+    return config
+
+
+def storage_path(storage_dir, filename):
+    """
+    Returns the path of a file in the storage directory of an app.
+
+    Example:
+
+        >>> storage_path("/data", "climate-preheat.json")
+        '/data/climate-preheat.json'
+
+    Args:
+        storage_dir: The `storage_dir` of the app. Falls back to `DEFAULT_STORAGE_DIR` if not set.
+        filename: Name of the file.
+
+    Returns:
+        Returns the path of the file.
+    """
+    return os.path.join(storage_dir or DEFAULT_STORAGE_DIR, filename)
+
+
+def load_json(path, default=None):
+    """
+    Loads the json document stored at `path`. Returns `default` if the file does not exist or is not readable.
+
+    Args:
+        path: The file to load.
+        default: The value to return if the file cannot be loaded.
+
+    Returns:
+        Returns the loaded document or `default`.
+    """
+    try:
+        with open(path, 'r') as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return default
+
+
+def save_json(path, document):
+    """
+    Stores the given json serializable document at `path` atomically (see `atomic_write`).
+
+    Args:
+        path: The file to write.
+        document: The json serializable document.
+    """
+    atomic_write(path, json.dumps(document, sort_keys=True).encode())
+
+
+class DecayingHistogram:
+    """
+    A histogram over fixed buckets whose counts decay with every observation: Old observations fade out, so it
+    follows a changing distribution while taking constant memory.
+
+    Example:
+
+        >>> histogram = DecayingHistogram(bounds=(10, 20, 30), decay=0.5)
+        >>> for value in (5, 15, 25, 25):
+        ...     histogram.observe(value)
+        >>> histogram.quantile(0.5)
+        30
+        >>> histogram.weight
+        1.875
+
+    Args:
+        bounds: The (inclusive) upper bounds of the buckets in ascending order. Larger values are counted as well, but
+            their quantile is None.
+        decay: Factor the counts are multiplied with before each observation.
+    """
+    __slots__ = ('bounds', 'decay', 'counts')
+
+    def __init__(self, bounds, decay=0.98, counts=None):
+        self.bounds = tuple(bounds)
+        self.decay = decay
+        self.counts = list(counts) if counts is not None else [0.0] * (len(self.bounds) + 1)  # The last: Overflow
+
+    @property
+    def weight(self):
+        return sum(self.counts)
+
+    def observe(self, value):
+        counts, decay = self.counts, self.decay
+        for i, count in enumerate(counts):
+            counts[i] = count * decay
+        counts[bisect.bisect_left(self.bounds, value)] += 1
+
+    def quantile(self, q):
+        """Returns the upper bound of the bucket holding the `q` quantile (None if there is no such bound)."""
+        rank, seen = q * self.weight, 0.0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if count and seen >= rank:
+                return bound
+        return None
+
+    def to_dict(self):
+        return {"bounds": list(self.bounds), "decay": self.decay, "counts": self.counts}
+
+    @classmethod
+    def from_dict(cls, dct):
+        return cls(bounds=dct["bounds"], decay=dct["decay"], counts=dct["counts"])
+
+
+class TimerHeap:
+    """
+    Multiplexes any number of keyed timers onto a single appdaemon timer. The timers are kept in a heap ordered by
+    their due time and only the earliest one is scheduled with appdaemon. Scheduling a key again replaces its
+    previous timer. Safe to use from any worker thread; the callbacks are called without holding the lock, so they
+    may schedule or cancel timers themselves.
+
+    Args:
+        hass: The app to schedule the appdaemon timer with.
+        callback: Called with the key and the payload of each timer that is due.
+    """
+    __slots__ = ('_hass', '_callback', '_heap', '_entries', '_seq', '_handle', '_armed', '_lock')
+
+    def __init__(self, hass, callback):
+        self._hass = hass
+        self._callback = callback
+        self._heap = []  # (due, seq, key, payload) - includes replaced / cancelled timers until they surface
+        self._entries = {}  # key -> seq of its active timer
+        self._seq = itertools.count()
+        self._handle = None  # The appdaemon timer ...
+        self._armed = None  # ... and the due time it fires at
+        self._lock = threading.Lock()  # Timers are scheduled and fired on different worker threads
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def schedule(self, key, delay, payload=None):
+        """Schedules (or reschedules) the timer `key` in `delay` seconds."""
+        # Via the timestamp: The local time `delay` seconds from now is more or less than that across a DST change
+        self.schedule_at(key, datetime.datetime.fromtimestamp(self._hass.datetime().timestamp() + delay), payload)
+
+    def schedule_at(self, key, due, payload=None):
+        """Schedules (or reschedules) the timer `key` at the local datetime `due`. Overdue timers fire right away."""
+        with self._lock:
+            seq = next(self._seq)
+            self._entries[key] = seq
+            heapq.heappush(self._heap, (due, seq, key, payload))
+            if len(self._heap) > 2 * len(self._entries) + 64:  # Mostly replaced timers: Compact
+                self._heap = [entry for entry in self._heap if self._entries.get(entry[2]) == entry[1]]
+                heapq.heapify(self._heap)
+            self._arm()
+
+    def cancel(self, key):
+        """Cancels the timer `key` (if any). The appdaemon timer is left alone: It will re-arm for the next one."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def pending(self):
+        """Returns the active timers as key -> (due, payload)."""
+        with self._lock:
+            return {key: (due, payload) for due, seq, key, payload in self._heap if self._entries.get(key) == seq}
+
+    def _arm(self):
+        # Called with the lock held
+        heap = self._heap
+        while heap and self._entries.get(heap[0][2]) != heap[0][1]:
+            heapq.heappop(heap)  # Replaced or cancelled
+        if not heap:
+            return
+        due = heap[0][0]
+        if self._armed is not None and self._armed <= due:
+            return  # Fires in time anyway
+        if self._handle is not None:
+            self._hass.cancel_timer(self._handle)
+        delay = max(0, math.ceil(due.timestamp() - self._hass.datetime().timestamp()))  # DST changes included
+        self._handle, self._armed = self._hass.run_in(self._on_timer, delay), due
+
+    def _on_timer(self, kwargs):
+        due = []
+        with self._lock:
+            self._handle, self._armed = None, None
+            now, heap = self._hass.datetime(), self._heap
+            while heap and heap[0][0] <= now:
+                _, seq, key, payload = heapq.heappop(heap)
+                if self._entries.get(key) == seq:
+                    del self._entries[key]
+                    due.append((key, payload))
+        for key, payload in due:
+            self._callback(key, payload)
+        with self._lock:
+            self._arm()
+
+
+class StateAwaiter:
+    """
+    Waits for an entity to reach a state without blocking a worker thread: Listens for the confirming state change
+    and gives up after `timeout` seconds. `callback` is called exactly once with the entity and True (confirmed) or
+    False (timed out). Create it before calling the services that change the entity - otherwise the change might be
+    missed. The current state is not checked: If the entity is already up to date there is no change to confirm.
+
+    Args:
+        hass: The app to listen / schedule the timeout with.
+        entity: The entity to wait for.
+        callback: Called with the entity and whether the state was confirmed.
+        state: The state to wait for (None: Any state).
+        attributes: The attributes to wait for, e.g. {"options": [...]} (None: Any attributes).
+        timeout: Seconds to wait at most.
+    """
+    __slots__ = ('_hass', '_entity', '_callback', '_state', '_attributes', '_listener', '_timer', '_lock')
+
+    def __init__(self, hass, entity, callback, state=None, attributes=None, timeout=10):
+        self._hass = hass
+        self._entity = entity
+        self._callback = callback
+        self._state = state
+        self._attributes = attributes or {}
+        self._lock = threading.Lock()  # The change and the timeout might race on different worker threads
+        self._listener = hass.listen_state(self._on_change, entity, attribute="all")
+        self._timer = hass.run_in(self._on_timeout, timeout)
+
+    @property
+    def done(self):
+        return self._listener is None
+
+    def cancel(self):
+        """Stops waiting without calling the callback."""
+        self._finish()
+
+    def _on_change(self, entity, attribute, old, new, kwargs):
+        new = new or {}
+        if self._state is not None and new.get("state") != self._state:
+            return  # Home assistant has not caught up yet
+        attributes = new.get("attributes") or {}
+        if any(attributes.get(key) != value for key, value in self._attributes.items()):
+            return
+        if self._finish():
+            self._callback(self._entity, True)
+
+    def _on_timeout(self, kwargs):
+        self._timer = None  # Fired
+        if self._finish():
+            self._callback(self._entity, False)
+
+    def _finish(self):
+        """Stops listening. Returns False if it was done already."""
+        with self._lock:
+            listener, self._listener = self._listener, None
+            timer, self._timer = self._timer, None
+        if listener is None:
+            return False
+        self._hass.cancel_listen_state(listener)
+        if timer is not None:
+            self._hass.cancel_timer(timer)
+        return True
@@ -0,0 +1,41 @@
+"""
+Compares the startup cost of validating and building a large climate config with loading it from the config cache.
+
+Usage: python benchmarks/bench_config_cache.py
+"""
+import shutil
+import tempfile
+import timeit
+
+from fakes import make_climate_args
+
+import climate
+import utils
+
+
+ROOMS = 200
+
+
+def build(args):
+    return climate.Config.from_dict(climate.Validator.validate_config(args))
+
+
+def main():
+    args = make_climate_args(rooms=ROOMS, schedules=16)
+    storage_dir = tempfile.mkdtemp()
+    try:
+        def cached():
+            return utils.cached_config(args, build, source=climate.__file__, name="climate", storage_dir=storage_dir)
+
+        cold = min(timeit.repeat(lambda: build(args), number=1, repeat=3))
+        cached()  # Warm up the cache
+        warm = min(timeit.repeat(cached, number=1, repeat=3))
+        assert len(cached().rooms) == ROOMS
+        print("{rooms} rooms: validate + build {cold:.1f}ms, cached {warm:.1f}ms ({ratio:.1f}x)".format(
+            rooms=ROOMS, cold=cold * 1000, warm=warm * 1000, ratio=cold / warm))
+    finally:
+        shutil.rmtree(storage_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+"""
+Measures the overhead of the instrumentation on a climate constraint change callback (all rooms depend on the
+constraint): Instrumentation off (nothing wrapped) vs. on (call counters and a latency histogram).
+
+Usage: python benchmarks/bench_instrumentation.py
+"""
+import timeit
+
+from fakes import make_climate_app, make_climate_args, make_climate_states
+
+import instrumentation
+
+
+ROOMS = 50
+FIRES = 200
+
+
+def make_app(metrics):
+    app = make_climate_app(make_climate_args(rooms=ROOMS), make_climate_states(rooms=ROOMS))
+    app.metrics = instrumentation.setup(app, {"interval": 60} if metrics else None)
+    handle = app.listen_state(app._on_constraint_change, "input_boolean.constraint_0")
+    callback, entity, kwargs = app.listeners[handle]
+    return app, lambda: callback(entity, None, "off", "on", kwargs)
+
+
+def main():
+    for metrics in (False, True):
+        app, fire = make_app(metrics)
+        best = min(timeit.repeat(fire, number=FIRES, repeat=5)) / FIRES
+        print("metrics {}: {:.1f}us per callback".format("on " if metrics else "off", best * 1e6))
+
+    print("published attributes: {}".format(sorted(app.metrics.as_attributes())))
+    print("prometheus text: {} lines".format(len(app.metrics.as_prometheus().splitlines())))
+
+
+if __name__ == '__main__':
+    main()
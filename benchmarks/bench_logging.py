@@ -0,0 +1,44 @@
+"""
+Replays a burst of motion events (motion on / off pairs with limit checks) against the motion app with logging on
+(log level DEBUG) and off (log level WARNING). Messages below the log level are not even formatted.
+
+Usage: python benchmarks/bench_logging.py
+"""
+import io
+import timeit
+
+from fakes import make_motion_app, make_motion_args, make_motion_states
+
+import utils
+
+
+EVENTS = 1000
+
+
+def make_burst(level):
+    app = make_motion_app(dict(make_motion_args(), log_level=level), make_motion_states())
+    sink = io.StringIO()
+    app.logger = utils.Logger(lambda msg, level="INFO": sink.write("{} {}\n".format(level, msg)), level)
+    on = [(cb, entity, kw) for cb, entity, kw in app.listeners.values() if kw.get("new") == "on"]
+    off = [(cb, entity, kw) for cb, entity, kw in app.listeners.values() if kw.get("new") == "off"]
+
+    def burst():
+        for i in range(EVENTS // 2):
+            callback, entity, kwargs = on[i % len(on)]
+            callback(entity, None, "off", "on", kwargs)
+            callback, entity, kwargs = off[i % len(off)]
+            callback(entity, None, "on", "off", kwargs)
+    return burst, sink
+
+
+def main():
+    for level in ("DEBUG", "WARNING"):
+        burst, sink = make_burst(level)
+        best = min(timeit.repeat(burst, number=1, repeat=5))
+        lines = sink.getvalue().count("\n") // 5
+        print("log level {:7}: {} events in {:.2f}ms ({:.1f}us/event), {} log lines".format(
+            level, EVENTS, best * 1000, best / EVENTS * 1e6, lines))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Memory and throughput of the slotted, frozen climate model compared to the former dict based layout
+(`datetime.time` start and end, weekday lists).
+
+Usage: python benchmarks/bench_model.py
+"""
+import datetime
+import timeit
+import tracemalloc
+
+import attr
+
+from fakes import FakeHass, make_climate_args, make_climate_states
+
+import climate
+
+
+ROOMS = 250
+SCHEDULES = 16  # Per room in comfort mode, half of it in energy mode
+
+
+@attr.s
+class LegacySchedule:
+    setpoint = attr.ib()
+    start = attr.ib()
+    end = attr.ib()
+    weekdays = attr.ib()
+    constraints = attr.ib()
+
+    @classmethod
+    def from_schedule(cls, sched):
+        return cls(
+            setpoint=sched.setpoint,
+            start=datetime.time(*divmod(sched.start, 60)),
+            end=datetime.time(*divmod(sched.end, 60)),
+            weekdays=[wday for wday in range(1, 8) if sched.on_weekday(wday)],
+            constraints=[climate.BinarySensor(c.entity) for c in sched.constraints]
+        )
+
+
+def measure(factory):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    objects = factory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    return objects, sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+
+
+def main():
+    cfg = climate.Config.from_dict(climate.Validator.validate_config(make_climate_args(ROOMS, SCHEDULES)))
+    schedules = [sched for room in cfg.rooms for ctrl in room.controls.values() for sched in ctrl.schedules]
+
+    _, legacy_size = measure(lambda: [LegacySchedule.from_schedule(sched) for sched in schedules])
+    _, slotted_size = measure(lambda: [climate.Schedule(
+        setpoint=sched.setpoint, start=sched.start, end=sched.end, weekdays=sched.weekdays,
+        constraints=tuple(climate.BinarySensor(c.entity) for c in sched.constraints)
+    ) for sched in schedules])
+    print("{n} schedules: legacy {legacy:.0f} KiB, slotted {slotted:.0f} KiB ({ratio:.1f}x smaller)".format(
+        n=len(schedules), legacy=legacy_size / 1024, slotted=slotted_size / 1024, ratio=legacy_size / slotted_size))
+
+    hass = FakeHass(make_climate_states(ROOMS))
+    snapshot = climate.StateSnapshot.fetch(hass)
+    monday = datetime.datetime(2019, 1, 7)
+    samples = [monday + datetime.timedelta(minutes=m) for m in range(0, climate.MINUTES_PER_WEEK, 211)]
+
+    def run():
+        for dt in samples:
+            for room in cfg.rooms:
+                room.eval_setpoint(climate.Mode.Comfort, hass, dt, snapshot)
+
+    evals = len(samples) * len(cfg.rooms)
+    best = min(timeit.repeat(run, number=1, repeat=5))
+    print("{evals} evaluations in {best:.3f}s ({rate:,.0f} evals/s)".format(evals=evals, best=best, rate=evals / best))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Replays a week of motion in a busy room (long stays with pauses between the motion events) and in a hallway (short
+passes) through the motion app with a fixed off delay and with the adaptive one. Reports the hours the lights were on,
+the light service calls and the flickers (lights turned on again within 10 minutes after turning them off).
+
+Usage: python benchmarks/bench_motion_adaptive.py [days]
+"""
+import datetime
+import random
+import sys
+import tempfile
+
+from simulator import Simulation
+
+import motion
+
+
+START = datetime.datetime(2019, 1, 7)
+FLICKER = datetime.timedelta(minutes=10)
+
+
+def make_script(days, seed=42):
+    rnd = random.Random(seed)
+    script = []
+
+    def pulse(at, entity, seconds):
+        script.append((at, entity, "on"))
+        script.append((at + datetime.timedelta(seconds=seconds), entity, "off"))
+        return at + datetime.timedelta(seconds=seconds)
+
+    for day in range(days):
+        morning = START + datetime.timedelta(days=day, hours=8)
+        for session in range(3):  # Office: Sessions of ~2h with pauses of a few minutes between the motion
+            at = morning + datetime.timedelta(hours=session * 4)
+            end = at + datetime.timedelta(hours=2)
+            while at < end:
+                at = pulse(at, "binary_sensor.office", rnd.randint(20, 120))
+                at += datetime.timedelta(seconds=min(rnd.lognormvariate(5.0, 0.6), 1200))
+        at = morning - datetime.timedelta(hours=1)
+        for _ in range(20):  # Hallway: Short passes - now and then someone comes back right away
+            at = pulse(at, "binary_sensor.hallway", rnd.randint(5, 20))
+            if rnd.random() < 0.2:
+                at = pulse(at + datetime.timedelta(seconds=rnd.randint(10, 40)), "binary_sensor.hallway", 10)
+            at += datetime.timedelta(minutes=rnd.randint(10, 60))
+    return script
+
+
+def replay(days, adaptive):
+    args = {
+        "for": "5m",
+        "adaptive": {"percentile": 95, "min": "30s", "max": "10m"} if adaptive else None,
+        "storage_dir": tempfile.mkdtemp(),
+        "zones": {
+            "office": {"motion": "binary_sensor.office", "lights": "light.office"},
+            "hallway": {"motion": "binary_sensor.hallway", "lights": "light.hallway"}
+        }
+    }
+    states = {e: {"state": "off", "attributes": {}} for e in ("light.office", "light.hallway")}
+    sim = Simulation(motion.App, args, states, start=START, name="motion")
+    sim.run(START + datetime.timedelta(days=days), script=make_script(days), step=datetime.timedelta(hours=1))
+    return sim.hass.calls
+
+
+def summarize(calls):
+    on_since, on_time, flickers, last_off = {}, {}, 0, {}
+    for at, service, kwargs in calls:
+        for entity in kwargs["entity_id"]:
+            if service.endswith("turn_on"):
+                on_since[entity] = at
+                flickers += entity in last_off and at - last_off[entity] < FLICKER
+            else:
+                on_time[entity] = on_time.get(entity, datetime.timedelta()) + at - on_since.pop(entity)
+                last_off[entity] = at
+    hours = {entity: round(on.total_seconds() / 3600, 1) for entity, on in sorted(on_time.items())}
+    return "lights on {} hours, {} service calls, {} flickers".format(hours, len(calls), flickers)
+
+
+def main():
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else 7
+    print("   fixed 5m: " + summarize(replay(days, adaptive=False)))
+    print("adaptive p95: " + summarize(replay(days, adaptive=True)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+"""
+Replays a burst of motion events (retriggers while the lights are on) against the motion app. Reports the home
+assistant reads (the lux sensors are served from memory), the light service calls (grouped, skipped if the lights
+are on already) and the measured motion to turn on latency.
+
+Usage: python benchmarks/bench_motion_latency.py
+"""
+from fakes import make_motion_app, make_motion_args, make_motion_states
+
+
+EVENTS = 1000
+SENSORS = 4
+LIGHTS = 3
+
+
+def main():
+    app = make_motion_app(
+        dict(make_motion_args(lights=LIGHTS, sensors=SENSORS), metrics={"interval": 60}),
+        make_motion_states(sensors=SENSORS)
+    )
+    on = [(cb, entity, kw) for cb, entity, kw in app.listeners.values() if kw.get("new") == "on"]
+    reads = app.get_state_calls
+    for i in range(EVENTS):
+        callback, entity, kwargs = on[i % len(on)]
+        callback(entity, None, "off", "on", kwargs)
+    print("{} motion events, {} lux sensors: {} get_state calls".format(EVENTS, SENSORS, app.get_state_calls - reads))
+    print("{} lights: {} service calls (one per light and event: {})".format(
+        LIGHTS, len(app.service_calls), EVENTS * LIGHTS))
+
+    for (metric, entity), histogram in sorted(app.metrics.histograms.items()):
+        if metric == "motion_to_turn_on_seconds":
+            print("motion to turn on @ {}: mean {:.1f}us, p95 <= {:.1f}ms".format(
+                entity, histogram.total / histogram.count * 1e6, histogram.quantile(0.95) * 1000))
+
+
+if __name__ == '__main__':
+    main()
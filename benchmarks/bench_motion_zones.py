@@ -0,0 +1,69 @@
+"""
+Compares a house with many motion zones set up as one app instance per zone with a single app instance that serves
+all zones from its `zones` table: Startup time, listeners, get_state calls and appdaemon timers. Also measures the
+event throughput of the zone table instance.
+
+Usage: python benchmarks/bench_motion_zones.py
+"""
+import random
+import tempfile
+import time
+
+from fakes import make_motion_app, make_motion_args, make_motion_states
+
+
+ZONES = 30
+EVENTS = 20000
+
+
+def zone_args(i):
+    args = make_motion_args(lights=2, motion=1, sensors=1)
+    args["lights"] = ["light.zone_{}_{}".format(i, n) for n in range(2)]
+    args["motion"] = ["binary_sensor.motion_{}".format(i)]
+    args["sensor"][0]["entity"] = "sensor.lux_{}".format(i % 5)  # Lux sensors are shared by several zones
+    return args
+
+
+def main():
+    storage_dir = tempfile.mkdtemp()
+    states = make_motion_states(sensors=5)
+
+    started = time.perf_counter()
+    apps = [make_motion_app(dict(zone_args(i), storage_dir=storage_dir), states, name="zone_{}".format(i))
+            for i in range(ZONES)]
+    elapsed = time.perf_counter() - started
+    print("{} instances: startup {:.1f}ms, {} listeners, {} get_state calls".format(
+        ZONES, elapsed * 1000, sum(len(app.listeners) for app in apps), sum(app.get_state_calls for app in apps)))
+
+    started = time.perf_counter()
+    app = make_motion_app({
+        "storage_dir": storage_dir,
+        "zones": {"zone_{}".format(i): zone_args(i) for i in range(ZONES)}
+    }, states, name="house")
+    elapsed = time.perf_counter() - started
+    print("  1 instance:  startup {:.1f}ms, {} listeners, {} get_state calls".format(
+        elapsed * 1000, len(app.listeners), app.get_state_calls))
+
+    for i in range(ZONES):  # Motion ended everywhere: Every zone waits for its off delay
+        callbacks = [(cb, kw) for cb, entity, kw in app.listeners.values()
+                     if entity == "binary_sensor.motion_{}".format(i) and kw.get("new") == "off"]
+        for callback, kwargs in callbacks:
+            callback("binary_sensor.motion_{}".format(i), None, "on", "off", kwargs)
+    print("pending off delays: {}, appdaemon timers: {}".format(len(app._timers), len(app.timers)))
+
+    rnd = random.Random(42)
+    motion = {}
+    for callback, entity, kwargs in app.listeners.values():
+        if entity.startswith("binary_sensor.") and "new" in kwargs:
+            motion.setdefault(entity, []).append((callback, kwargs))
+    events = [rnd.choice(sorted(motion)) for _ in range(EVENTS // 2)]
+    started = time.perf_counter()
+    for entity in events:
+        for callback, kwargs in motion[entity]:
+            callback(entity, None, "off" if kwargs["new"] == "on" else "on", kwargs["new"], kwargs)
+    elapsed = time.perf_counter() - started
+    print("throughput: {} events in {:.1f}ms ({:,.0f} events/s)".format(EVENTS, elapsed * 1000, EVENTS / elapsed))
+
+
+if __name__ == '__main__':
+    main()
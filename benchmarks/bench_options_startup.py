@@ -0,0 +1,55 @@
+"""
+Starts a presence app that sets the state options of its persons against a simulated home assistant that applies
+service calls with a latency. Reports the wall clock time `initialize` blocks the worker thread and the simulated
+time until the app is started (listening to its trackers) - it waits exactly as long as home assistant needs, at most
+`OPTIONS_TIMEOUT` seconds. A fixed sleep of one second used to block the worker and raced with slower latencies.
+
+Usage: python benchmarks/bench_options_startup.py
+"""
+import datetime
+import tempfile
+import time
+
+from fakes import make_presence_args, make_presence_states
+from simulator import SimulatedHass
+
+import presence
+
+
+START = datetime.datetime(2019, 1, 7)
+PERSONS = 5
+LATENCIES = (0.2, 3, 30)  # Seconds home assistant takes to apply a service call
+
+
+class SlowHass(SimulatedHass):
+    """Applies every service call `latency` seconds after it was issued."""
+    latency = 0
+
+    def call_service(self, service, **kwargs):
+        self.run_in(lambda _: SimulatedHass.call_service(self, service, **kwargs), self.latency)
+
+
+def main():
+    args = make_presence_args(persons=PERSONS)
+    for person in args["persons"].values():
+        person["init_options"] = True
+
+    for latency in LATENCIES:
+        class App(SlowHass, presence.App):
+            pass
+
+        app = App(make_presence_states(persons=PERSONS), start=START, name="household")
+        app.latency = latency
+        app.args = dict(args, storage_dir=tempfile.mkdtemp())
+        started = time.perf_counter()
+        app.initialize()
+        blocked = time.perf_counter() - started
+
+        while not any(entity.startswith("device_tracker.") for _, entity, _ in app.listeners.values()):
+            app.advance(app.now + datetime.timedelta(seconds=0.1))
+        print("latency {:4.1f}s: initialize blocked {:.1f}ms, started after {:4.1f}s (simulated)".format(
+            latency, blocked * 1000, (app.now - START).total_seconds()))
+
+
+if __name__ == '__main__':
+    main()
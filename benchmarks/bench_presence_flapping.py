@@ -0,0 +1,95 @@
+"""
+Replays a week of a person leaving for work on weekdays through the presence app. The wifi tracker of the phone flaps
+(drops out for a few minutes now and then while at home), the gps tracker is reliable but lags behind. Compares a
+single tracker with fused trackers, with and without a debounce window. Reports the select_option writes, the false
+departures (`just_left` while at home) and the mean delay until a real departure / arrival is applied.
+
+Usage: python benchmarks/bench_presence_flapping.py [days]
+"""
+import datetime
+import random
+import sys
+
+from simulator import Simulation
+
+import presence
+
+
+START = datetime.datetime(2019, 1, 7)
+WIFI = "device_tracker.paula_wifi"
+GPS = "device_tracker.paula_gps"
+STATE = "input_select.paula_state"
+
+SCENARIOS = [
+    ("wifi only", {"tracker": WIFI}),
+    ("wifi only, debounce 5m", {"tracker": WIFI, "debounce": "5m"}),
+    ("wifi + gps (any)", {"tracker": [WIFI, GPS], "fusion": "any"}),
+    ("wifi + gps (any), debounce 2m", {"tracker": [WIFI, GPS], "fusion": "any", "debounce": "2m"}),
+]
+
+
+def make_script(days, seed=42):
+    """Returns the tracker events and the real (left, arrived) times."""
+    rnd = random.Random(seed)
+    script, trips = [], []
+    for day in range(days):
+        date = START + datetime.timedelta(days=day)
+        if date.weekday() >= 5:
+            away = []
+        else:
+            away = [(date + datetime.timedelta(hours=8, minutes=rnd.randint(0, 30)),
+                     date + datetime.timedelta(hours=17, minutes=rnd.randint(0, 60)))]
+        for left, arrived in away:
+            trips.append((left, arrived))
+            script.append((left + datetime.timedelta(seconds=rnd.randint(30, 90)), WIFI, "not_home"))
+            script.append((arrived + datetime.timedelta(seconds=rnd.randint(10, 60)), WIFI, "home"))
+            script.append((left + datetime.timedelta(seconds=rnd.randint(120, 300)), GPS, "not_home"))
+            script.append((arrived + datetime.timedelta(seconds=rnd.randint(120, 300)), GPS, "home"))
+
+        at = date
+        while True:  # The wifi tracker drops out about twice an hour for one to four minutes while at home
+            at += datetime.timedelta(seconds=rnd.expovariate(1 / 1800))
+            if at >= date + datetime.timedelta(days=1):
+                break
+            if any(left - datetime.timedelta(minutes=5) <= at <= arrived + datetime.timedelta(minutes=5)
+                   for left, arrived in away):
+                continue
+            back = at + datetime.timedelta(seconds=rnd.randint(60, 240))
+            script.append((at, WIFI, "not_home"))
+            script.append((back, WIFI, "home"))
+            at = back
+    return script, trips
+
+
+def run(args, script, trips, days):
+    states = {entity: {"state": "home", "attributes": {}} for entity in (WIFI, GPS, STATE)}
+    args = dict(args, state=STATE, just_left_delay="10m", just_arrived_delay="10m")
+    sim = Simulation(presence.App, args, states, start=START, name="paula")
+    sim.run(until=START + datetime.timedelta(days=days), script=script)
+
+    writes = [(at, kwargs["option"]) for at, service, kwargs in sim.hass.calls
+              if service == "input_select/select_option"]
+
+    def delay(option, since):
+        return min((at - since).total_seconds() for at, written in writes if written == option and at >= since)
+
+    false_departures = sum(1 for at, option in writes
+                           if option == "just_left" and not any(left <= at < arrived for left, arrived in trips))
+    leaving = [delay("just_left", left) for left, _ in trips]
+    arriving = [delay("just_arrived", arrived) for _, arrived in trips]
+    return len(writes), false_departures, sum(leaving) / len(leaving), sum(arriving) / len(arriving)
+
+
+def main():
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else 7
+    script, trips = make_script(days)
+    print("{} days, {} tracker events, {} trips".format(days, len(script), len(trips)))
+    for name, args in SCENARIOS:
+        writes, false_departures, leaving, arriving = run(args, script, trips, days)
+        print("{:<30} {:4d} select_option writes, {:3d} false departures, "
+              "departure after {:5.0f}s, arrival after {:5.0f}s".format(
+                  name + ":", writes, false_departures, leaving, arriving))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Compares a household set up as one presence app instance per person with a single app instance that serves all
+persons from its `persons` table: Startup time, get_state calls, listeners and appdaemon timers. Also measures the
+tracker event throughput of the persons table instance.
+
+Usage: python benchmarks/bench_presence_persons.py
+"""
+import random
+import tempfile
+import time
+
+from fakes import make_presence_app, make_presence_args, make_presence_states
+
+
+PERSONS = 20
+EVENTS = 20000
+
+
+def main():
+    storage_dir = tempfile.mkdtemp()
+    args = make_presence_args(persons=PERSONS)
+    states = make_presence_states(persons=PERSONS)
+
+    started = time.perf_counter()
+    apps = []
+    for name, person in sorted(args["persons"].items()):
+        single = {k: v for k, v in args.items() if k != "persons"}
+        single.update(person, storage_dir=storage_dir)
+        apps.append(make_presence_app(single, states, name=name))
+    elapsed = time.perf_counter() - started
+    print("{} instances: startup {:.1f}ms, {} get_state calls, {} listeners, {} timers".format(
+        PERSONS, elapsed * 1000, sum(app.get_state_calls for app in apps), sum(len(app.listeners) for app in apps),
+        sum(len(app.timers) for app in apps)))
+
+    started = time.perf_counter()
+    app = make_presence_app(dict(args, storage_dir=storage_dir), states, name="household")
+    elapsed = time.perf_counter() - started
+    print("  1 instance:  startup {:.1f}ms, {} get_state calls, {} listeners, {} timers".format(
+        elapsed * 1000, app.get_state_calls, len(app.listeners), len(app.timers)))
+
+    rnd = random.Random(42)
+    trackers = {entity: callback for callback, entity, _ in app.listeners.values()}
+    home = {entity: states[entity]["state"] == "home" for entity in trackers}
+    events = [rnd.choice(sorted(trackers)) for _ in range(EVENTS)]
+    started = time.perf_counter()
+    for entity in events:
+        old, new = ("home", "not_home") if home[entity] else ("not_home", "home")
+        home[entity] = not home[entity]
+        trackers[entity](entity, None, old, new, {})
+    elapsed = time.perf_counter() - started
+    print("throughput: {} tracker events in {:.1f}ms ({:,.0f} events/s)".format(
+        EVENTS, elapsed * 1000, EVENTS / elapsed))
+
+
+if __name__ == '__main__':
+    main()
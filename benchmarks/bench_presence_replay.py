@@ -0,0 +1,118 @@
+"""
+Replays synthetic tracker events through the presence state machine (`presence.Engine`) offline: No hass, no
+appdaemon - the timers run on a simulated clock. Reports the events per second and the resulting state timeline.
+
+Usage: python benchmarks/bench_presence_replay.py [events] [persons]
+"""
+import collections
+import datetime
+import random
+import sys
+import time
+
+import fakes  # noqa: F401 - Puts the apps on the path
+
+import presence
+import utils
+
+
+START = datetime.datetime(2019, 1, 7)
+
+
+class Clock:
+    """Just enough of the hass api for a `utils.TimerHeap`: A simulated clock and the pending appdaemon timer."""
+
+    def __init__(self, now):
+        self.now = now
+        self.pending = None  # (due, callback)
+
+    def datetime(self):
+        return self.now
+
+    def run_in(self, callback, delay, **kwargs):
+        self.pending = (self.now + datetime.timedelta(seconds=delay), callback)
+        return self.pending
+
+    def cancel_timer(self, handle):
+        if self.pending is handle:
+            self.pending = None
+
+    def advance(self, until):
+        while self.pending is not None and self.pending[0] <= until:
+            (self.now, callback), self.pending = self.pending, None
+            callback({})
+        self.now = until
+
+
+def make_persons(persons):
+    cfg = presence.Validator.validate({
+        "persons": {
+            "person_{}".format(i): {
+                "tracker": ["device_tracker.person_{}_wifi".format(i), "device_tracker.person_{}_gps".format(i)],
+                "state": "input_select.person_{}_state".format(i),
+                "debounce": "2m" if i % 2 else 0
+            } for i in range(persons)
+        }
+    })
+    return {name: presence.Person.from_config(name, pcfg, cfg) for name, pcfg in sorted(cfg["persons"].items())}
+
+
+def make_events(persons, count, seed=42):
+    """Random tracker flips: (time, tracker, hass state). On average every 30 seconds."""
+    rnd = random.Random(seed)
+    trackers = sorted(tracker for person in persons.values() for tracker in person.trackers)
+    home = dict.fromkeys(trackers, True)
+    at, events = START, []
+    for _ in range(count):
+        at += datetime.timedelta(seconds=rnd.expovariate(1 / 30))
+        tracker = rnd.choice(trackers)
+        home[tracker] = not home[tracker]
+        events.append((at, tracker, "home" if home[tracker] else "not_home"))
+    return events
+
+
+def replay(persons, events):
+    """Runs the events through a fresh engine. Returns the timeline: (time, person, State)."""
+    clock = Clock(START)
+    timeline = []
+    engine = presence.Engine(
+        persons, utils.TimerHeap(clock, lambda key, payload: engine.on_timer(key, payload)),
+        lambda person, state: timeline.append((clock.now, person.name, state)),
+        utils.Logger(lambda *args, **kwargs: None, "WARNING")
+    )
+    for person in persons.values():
+        engine.restore(person, presence.State.Home, dict.fromkeys(person.trackers, "home"))
+    for at, tracker, state in events:
+        clock.advance(at)
+        engine.on_tracker(tracker, state)
+    clock.advance(events[-1][0] + datetime.timedelta(days=2))
+    return timeline
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    persons = make_persons(int(sys.argv[2]) if len(sys.argv) > 2 else 20)
+    events = make_events(persons, count)
+
+    started = time.perf_counter()
+    timeline = replay(persons, events)
+    elapsed = time.perf_counter() - started
+    print("{} tracker events of {} persons ({:.0f} simulated days) in {:.2f}s ({:,.0f} events/s)".format(
+        count, len(persons), (events[-1][0] - START).total_seconds() / 86400, elapsed, count / elapsed))
+    print("timeline: {} state changes".format(len(timeline)))
+
+    durations = collections.Counter()
+    for name in ("person_0", "person_1"):
+        changes = [(at, state) for at, person, state in timeline if person == name]
+        for (at, state), (until, _) in zip(changes, changes[1:]):
+            durations[(name, state)] += (until - at).total_seconds()
+        total = (changes[-1][0] - START).total_seconds()
+        print("  {} ({}): {}".format(
+            name, "debounced" if persons[name].debounce else "not debounced",
+            ", ".join("{} {:.0%}".format(state.value, durations[(name, state)] / total) for state in presence.State)))
+        print("    first changes: {}".format(
+            ", ".join("{:%H:%M:%S} {}".format(at, state.value) for at, state in changes[:6])))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Restarts the presence app while a person is away and reports when the person is marked as extended away (24h after
+leaving): With the pending transitions stored in the `storage_dir` and without them (the countdown starts over). Also
+reports the hass calls and the time of the restart itself.
+
+Usage: python benchmarks/bench_presence_restart.py
+"""
+import datetime
+import os
+import tempfile
+import time
+
+from simulator import Simulation
+
+import presence
+
+
+START = datetime.datetime(2019, 1, 7)
+LEFT = START + datetime.timedelta(hours=8)
+ARGS = {
+    "tracker": "device_tracker.paula",
+    "state": "input_select.paula_state",
+    "just_left_delay": "10m",
+    "extended_away_delay": "24h"
+}
+DOWNTIMES = [  # (restart, up again)
+    (START + datetime.timedelta(hours=20), START + datetime.timedelta(hours=20, minutes=1)),
+    (START + datetime.timedelta(hours=20), START + datetime.timedelta(days=2, hours=10))  # Overdue when up again
+]
+
+
+def run(down, up, stored):
+    storage_dir = tempfile.mkdtemp()
+    args = dict(ARGS, storage_dir=storage_dir)
+    states = {
+        "device_tracker.paula": {"state": "home", "attributes": {}},
+        "input_select.paula_state": {"state": "home", "attributes": {}}
+    }
+    sim = Simulation(presence.App, args, states, start=START, name="paula")
+    sim.run(until=down, script=[(LEFT, "device_tracker.paula", "not_home")])
+    if not stored:
+        os.remove(os.path.join(storage_dir, "paula-presence.json"))
+
+    started = time.perf_counter()
+    sim = Simulation(presence.App, args, sim.hass.states, start=up, name="paula")
+    elapsed = time.perf_counter() - started
+    calls, get_state_calls = len(sim.hass.calls), sim.hass.get_state_calls
+    sim.run(until=up + datetime.timedelta(days=3))
+    extended = min(at for at, service, kwargs in sim.hass.calls if kwargs.get("option") == "extended_away")
+    return extended - LEFT, calls, get_state_calls, elapsed
+
+
+def main():
+    for down, up in DOWNTIMES:
+        print("left at {:%a %H:%M}, down at {:%a %H:%M}, up at {:%a %H:%M}".format(LEFT, down, up))
+        for stored in (False, True):
+            extended, calls, get_state_calls, elapsed = run(down, up, stored)
+            print("  {:<24} extended away {:5.1f}h after leaving, restart: {} service calls, {} get_state calls, "
+                  "{:.1f}ms".format("transitions stored:" if stored else "transitions not stored:",
+                                    extended.total_seconds() / 3600, calls, get_state_calls, elapsed * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Compares the former linear schedule scan of `Room.eval_setpoint` with the lookup in the compiled `ScheduleIndex`.
+
+Usage: python benchmarks/bench_schedule_index.py
+"""
+import datetime
+import timeit
+
+from fakes import FakeHass, make_climate_args, make_climate_states
+
+import climate
+
+
+ROOMS = 200
+
+
+def _is_time_between(begin_time, end_time, check_time):
+    if begin_time < end_time:
+        return check_time >= begin_time and check_time <= end_time
+    else:  # crosses midnight
+        return check_time >= begin_time or check_time <= end_time
+
+
+def legacy_schedules(room, mode):
+    """The schedules of the room in the representation they had before they were compiled."""
+    def as_time(minute):
+        return datetime.time(*divmod(minute, 60))
+
+    ctrl = room.controls[mode]
+    return ctrl.setpoint, [
+        (sched.setpoint, as_time(sched.start), as_time(sched.end),
+         [wday for wday in range(1, 8) if sched.on_weekday(wday)], sched.constraints)
+        for sched in ctrl.schedules
+    ]
+
+
+def scan_setpoint(legacy, hass, dt, snapshot):
+    """The lookup as it was done before the index was introduced."""
+    default, schedules = legacy
+    wday = dt.weekday() + 1
+    for setpoint, start, end, weekdays, constraints in schedules:
+        check_time = _is_time_between(start, end, dt.time())
+        check_weekdays = wday in weekdays
+        check_constraints = all([c.current(hass, snapshot) for c in constraints])
+        if check_time and check_weekdays and check_constraints:
+            return setpoint
+    return default
+
+
+def main():
+    cfg = climate.Config.from_dict(climate.Validator.validate_config(make_climate_args(rooms=ROOMS)))
+    hass = FakeHass(make_climate_states(rooms=ROOMS))
+    snapshot = climate.StateSnapshot.fetch(hass)
+    mode = climate.Mode.Comfort
+    monday = datetime.datetime(2019, 1, 7)
+    # Half a minute past the minute: the former scan includes the end minute, the index excludes it
+    samples = [monday + datetime.timedelta(minutes=m, seconds=30) for m in range(0, climate.MINUTES_PER_WEEK, 97)]
+
+    legacy = [legacy_schedules(room, mode) for room in cfg.rooms]
+
+    for room, schedules in zip(cfg.rooms, legacy):
+        for dt in samples:
+            expected = scan_setpoint(schedules, hass, dt, snapshot)
+            assert expected == room.eval_setpoint(mode, hass, dt, snapshot), (room.name, dt)
+
+    def run_scan():
+        for dt in samples:
+            for schedules in legacy:
+                scan_setpoint(schedules, hass, dt, snapshot)
+
+    def run_index():
+        for dt in samples:
+            for room in cfg.rooms:
+                room.eval_setpoint(mode, hass, dt, snapshot)
+
+    evals = len(samples) * len(cfg.rooms)
+    for name, func in (("scan", run_scan), ("index", run_index)):
+        best = min(timeit.repeat(func, number=1, repeat=5))
+        print("{name:>6}: {evals} evaluations in {best:.3f}s ({rate:,.0f} evals/s)".format(
+            name=name, evals=evals, best=best, rate=evals / best))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Replays a week (or any number of days) of minute-by-minute time through the climate app against a simulated home
+assistant. Includes daily mode changes and toggling constraints. Reports the evaluation throughput and the thermostat
+service calls per day.
+
+Usage: python benchmarks/bench_simulation.py [days]
+"""
+import collections
+import datetime
+import sys
+
+from fakes import make_climate_args, make_climate_states
+from simulator import Simulation
+
+import climate
+
+
+ROOMS = 50
+START = datetime.datetime(2019, 1, 7)  # A monday
+
+
+def make_script(days):
+    script = []
+    for day in range(days):
+        midnight = START + datetime.timedelta(days=day)
+        script.append((midnight + datetime.timedelta(hours=6), "input_select.heating_mode", "comfort"))
+        script.append((midnight + datetime.timedelta(hours=22, minutes=30), "input_select.heating_mode", "energy"))
+    for i in range(10):
+        entity = "input_boolean.constraint_{}".format(i)
+        period = datetime.timedelta(minutes=(i + 1) * 97)
+        at, state = START + period, "off"
+        while at < START + datetime.timedelta(days=days):
+            script.append((at, entity, state))
+            at, state = at + period, "on" if state == "off" else "off"
+    return script
+
+
+def main():
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else 7
+    evaluations = collections.Counter()
+    eval_setpoint = climate.Room.eval_setpoint
+
+    def counting_eval_setpoint(room, *args, **kwargs):
+        evaluations[room.name] += 1
+        return eval_setpoint(room, *args, **kwargs)
+
+    climate.Room.eval_setpoint = counting_eval_setpoint
+    try:
+        sim = Simulation(climate.App, make_climate_args(rooms=ROOMS), make_climate_states(rooms=ROOMS), start=START)
+        wall = sim.run(START + datetime.timedelta(days=days), script=make_script(days))
+    finally:
+        climate.Room.eval_setpoint = eval_setpoint
+
+    total = sum(evaluations.values())
+    thermostat_calls = [call for call in sim.hass.calls if not call[1].startswith("input_select")]
+    print("{days} days, {rooms} rooms replayed in {wall:.2f}s".format(days=days, rooms=ROOMS, wall=wall))
+    print("evaluations: {total} ({rate:,.0f} evals/s)".format(total=total, rate=total / wall))
+    print("thermostat service calls: {calls} ({per_day:.1f}/day)".format(
+        calls=len(thermostat_calls), per_day=len(thermostat_calls) / days))
+    print("timer fires: {}, get_state calls: {}".format(sim.hass.timer_fires, sim.hass.get_state_calls))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+"""
+Counts the state fetches of a full-house evaluation pass. All reads of the pass are served by one `StateSnapshot`
+that holds just the domains the rooms read - not the states of unrelated entities (appdaemon copies every state it
+returns). Also reports how many constraint reads the lazy constraint evaluation avoided.
+
+Usage: python benchmarks/bench_state_snapshot.py
+"""
+import timeit
+
+from fakes import make_climate_app, make_climate_args, make_climate_states
+
+
+ROOMS = 200
+UNRELATED = 2000  # Lights, sensors, ... the climate app does not care about
+
+
+def main():
+    states = make_climate_states(rooms=ROOMS)
+    for i in range(UNRELATED):
+        states["{}.unrelated_{}".format(("light", "sensor", "switch")[i % 3], i)] = {"state": "on", "attributes": {}}
+    app = make_climate_app(make_climate_args(rooms=ROOMS), states)
+    thermostats = sum(len(room.thermostats) for room in app._config.rooms)
+    constraints = sum(
+        len(sched.constraints) for room in app._config.rooms for sched in room.controls[app._mode].schedules
+    )
+    app._update_setpoints_for_all_rooms()
+    print("rooms: {rooms}, thermostats: {thermostats}, constraints: {constraints}, get_state calls: {calls}".format(
+        rooms=ROOMS, thermostats=thermostats, constraints=constraints, calls=app.get_state_calls))
+
+    snapshot = app._snapshot(app._config.rooms)
+    print("states read: {} of {} (domains: {})".format(
+        len(snapshot.states), len(states), ", ".join(app._config.domains)))
+    for room in app._config.rooms:
+        room.update_setpoints(hass=app, mode=app._mode, snapshot=snapshot)
+    print("constraint reads: {s.constraint_reads}, avoided: {s.constraint_reads_avoided}".format(s=snapshot))
+
+    best = min(timeit.repeat(app._update_setpoints_for_all_rooms, number=1, repeat=5))
+    print("full-house pass: {:.2f}ms".format(best * 1000))
+
+
+if __name__ == '__main__':
+    main()
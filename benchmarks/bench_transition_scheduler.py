@@ -0,0 +1,54 @@
+"""
+Compares the timers and the mode change latency of the former per-schedule `run_daily` timers with the single
+next-transition timer.
+
+Usage: python benchmarks/bench_transition_scheduler.py
+"""
+import timeit
+
+from fakes import make_climate_app, make_climate_args, make_climate_states
+
+import climate
+
+
+ROOMS = 200
+
+
+def legacy_make_schedules(app):
+    """The scheduling as it was done before the next-transition timer was introduced (without constraints)."""
+    for handle in app.schedules:
+        app.cancel_timer(handle)
+    app.schedules.clear()
+    for room in app._config.rooms:
+        for sched in room.controls[app._mode].schedules:
+            app.schedules.append(app.run_daily(lambda kwargs: None, sched.start, room=room))
+            app.schedules.append(app.run_daily(lambda kwargs: None, sched.end, room=room))
+
+
+def main():
+    app = make_climate_app(make_climate_args(rooms=ROOMS), make_climate_states(rooms=ROOMS))
+    app.schedules = []
+    modes = [climate.Mode.Comfort, climate.Mode.EnergySaving]
+
+    def switch(make_schedules):
+        def _run():
+            app._mode = modes[0] if app._mode is modes[1] else modes[1]
+            make_schedules()
+        return _run
+
+    for name, make_schedules in (("legacy", lambda: legacy_make_schedules(app)),
+                                 ("next-transition", app._schedule_next_transition)):
+        app.timers.clear()
+        best = min(timeit.repeat(switch(make_schedules), number=1, repeat=20))
+        print("{name:>16}: {timers} live timers, mode change rescheduling in {ms:.3f}ms".format(
+            name=name, timers=len(app.timers), ms=best * 1000))
+
+    minutes, _ = app._config.transitions(app._mode)
+    print("distinct transition minutes per week in mode '{}': {}".format(app._mode.value, len(minutes)))
+
+    best = min(timeit.repeat(lambda: app._on_mode_change(None, None, "energy", "comfort", {}), number=1, repeat=5))
+    print("full mode change (evaluation of all rooms included): {:.2f}ms".format(best * 1000))
+
+
+if __name__ == '__main__':
+    main()
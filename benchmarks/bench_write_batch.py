@@ -0,0 +1,41 @@
+"""
+Counts the thermostat service calls of whole-house mode changes. The writes of a pass are grouped by domain and
+setpoint into service calls with a list of entities - compared to one service call per thermostat.
+
+Usage: python benchmarks/bench_write_batch.py
+"""
+import timeit
+
+from fakes import make_climate_app, make_climate_args, make_climate_states
+
+import climate
+
+
+ROOMS = 200
+MODES = ["energy", "frost", "comfort"]
+
+
+def change_modes(app):
+    writes, calls = 0, 0
+    for mode in MODES:
+        app._mode = climate.Mode.from_str(mode)
+        del app.service_calls[:]
+        _, batch = app._update_setpoints(app._config.rooms)
+        assert batch.calls == len(app.service_calls)
+        writes, calls = writes + batch.writes, calls + batch.calls
+    return writes, calls
+
+
+def main():
+    app = make_climate_app(make_climate_args(rooms=ROOMS), make_climate_states(rooms=ROOMS))
+    writes, calls = change_modes(app)
+    print("{} mode changes, {} rooms: {} thermostat writes".format(len(MODES), ROOMS, writes))
+    print("  per thermostat: {} service calls".format(writes))
+    print("         grouped: {} service calls ({:.1f}x fewer)".format(calls, writes / calls))
+
+    best = min(timeit.repeat(lambda: change_modes(app), number=1, repeat=5))
+    print("mode changes (evaluation of all rooms included): {:.2f}ms".format(best * 1000))
+
+
+if __name__ == '__main__':
+    main()
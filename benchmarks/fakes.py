@@ -0,0 +1,225 @@
+"""
+Helpers shared by the benchmarks: a minimal stand-in for the hass api and generators for synthetic configs.
+"""
+import datetime
+import itertools
+import os
+import random
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "apps"))
+
+import utils  # noqa: E402
+
+
+class FakeHass:
+    """
+    Serves states from a dict (entity -> {"state": ..., "attributes": {...}}) and records every call that would hit
+    home assistant.
+    """
+
+    def __init__(self, states=None, name="fake"):
+        self.name = name
+        self.args = {}
+        self.states = states or {}
+        self.get_state_calls = 0
+        self.service_calls = []
+        self.timers = {}  # handle -> (callback, kwargs)
+        self.listeners = {}  # handle -> (callback, entity, kwargs)
+        self._handles = itertools.count(1)
+        self.logger = utils.Logger(self.log)
+
+    def log(self, msg, *args, **kwargs):
+        pass
+
+    def datetime(self):
+        return datetime.datetime.now()
+
+    def get_state(self, entity=None, attribute=None):
+        self.get_state_calls += 1
+        if entity is None:
+            return dict(self.states)
+        if "." not in entity:  # A domain: All of its entities, like appdaemon does
+            prefix = entity + "."
+            return {name: item for name, item in self.states.items() if name.startswith(prefix)}
+        item = self.states.get(entity)
+        if item is None:
+            return None
+        if attribute == "all":
+            return item
+        if attribute is not None:
+            return item["attributes"].get(attribute)
+        return item["state"]
+
+    def call_service(self, service, **kwargs):
+        self.service_calls.append((service, kwargs))
+
+    def set_state(self, entity_id, **kwargs):
+        pass
+
+    def turn_on(self, entity_id, **kwargs):
+        self.call_service("homeassistant/turn_on", entity_id=entity_id, **kwargs)
+
+    def turn_off(self, entity_id, **kwargs):
+        self.call_service("homeassistant/turn_off", entity_id=entity_id, **kwargs)
+
+    def _add_timer(self, callback, kwargs):
+        handle = next(self._handles)
+        self.timers[handle] = (callback, kwargs)
+        return handle
+
+    def run_in(self, callback, delay, **kwargs):
+        return self._add_timer(callback, kwargs)
+
+    def run_at(self, callback, start, **kwargs):
+        return self._add_timer(callback, kwargs)
+
+    def run_daily(self, callback, start, **kwargs):
+        return self._add_timer(callback, kwargs)
+
+    def run_every(self, callback, start, interval, **kwargs):
+        return self._add_timer(callback, kwargs)
+
+    def cancel_timer(self, handle):
+        self.timers.pop(handle, None)
+
+    def listen_state(self, callback, entity=None, **kwargs):
+        handle = next(self._handles)
+        self.listeners[handle] = (callback, entity, kwargs)
+        return handle
+
+    def cancel_listen_state(self, handle):
+        self.listeners.pop(handle, None)
+
+
+def with_storage_dir(args):
+    """Returns the app args with a temporary `storage_dir` unless one is set: Nothing is left in the checkout."""
+    return args if args.get("storage_dir") else dict(args, storage_dir=tempfile.mkdtemp())
+
+
+def make_climate_args(rooms=200, schedules=8, seed=42):
+    """Generates the (unvalidated) app args of a climate config with the given number of rooms."""
+    rnd = random.Random(seed)
+
+    def mk_schedule(i):
+        start = rnd.randrange(0, 24 * 60, 15)
+        end = (start + rnd.randrange(30, 8 * 60, 15)) % (24 * 60)
+        sched = {
+            "start": "{:02d}:{:02d}".format(start // 60, start % 60),
+            "end": "{:02d}:{:02d}".format(end // 60, end % 60),
+            "setpoint": rnd.randint(18, 24)
+        }
+        if i % 3 == 0:
+            sched["weekdays"] = rnd.choice(["1-5", "6,7", "3", "2-4"])
+        if i % 4 == 0:
+            sched["constraints"] = ["input_boolean.constraint_{}".format(rnd.randrange(10))]
+        return sched
+
+    return {
+        "check_interval": "5m",
+        "force_set_on_interval": False,
+        "mode": {"entity": "input_select.heating_mode"},
+        "rooms": {
+            "room_{}".format(r): {
+                "thermostats": ["input_number.heater_{}".format(r), "climate.heater_{}".format(r)],
+                "comfort": {"setpoint": 20, "schedule": [mk_schedule(i) for i in range(schedules)]},
+                "energy": {"setpoint": 17, "schedule": [mk_schedule(i) for i in range(schedules // 2)]},
+                "frost": {"setpoint": 8}
+            } for r in range(rooms)
+        }
+    }
+
+
+def make_climate_states(rooms=200, value="on"):
+    """Generates the states of all entities referenced by `make_climate_args`."""
+    def item(state, **attributes):
+        return {"state": state, "attributes": attributes}
+
+    states = {"input_boolean.constraint_{}".format(i): item(value) for i in range(10)}
+    states["input_select.heating_mode"] = item("comfort")
+    for r in range(rooms):
+        states["input_number.heater_{}".format(r)] = item("20.0")
+        states["climate.heater_{}".format(r)] = item("heat", temperature=20.0)
+    return states
+
+
+def make_climate_app(args, states, mode="comfort"):
+    """Creates a climate app that is wired to a `FakeHass` instead of a running appdaemon."""
+    import climate
+
+    class FakeClimateApp(FakeHass, climate.App):
+        pass
+
+    app = FakeClimateApp(states)
+    app.args = args
+    app._config = climate.Config.from_dict(climate.Validator.validate_config(args))
+    app._mode = climate.Mode.from_str(mode)
+    app._timers = utils.TimerHeap(app, app._on_timer)
+    return app
+
+
+def make_motion_args(lights=3, motion=2, sensors=2):
+    """Generates the (unvalidated) app args of a motion light with the given number of entities."""
+    return {
+        "for": "5m",
+        "lights": ["light.light_{}".format(i) for i in range(lights)],
+        "motion": ["binary_sensor.motion_{}".format(i) for i in range(motion)],
+        "sensor": [{"entity": "sensor.lux_{}".format(i), "op": "below", "value": 10} for i in range(sensors)]
+    }
+
+
+def make_motion_states(sensors=2, lux="5"):
+    """Generates the states of the sensors referenced by `make_motion_args`."""
+    return {"sensor.lux_{}".format(i): {"state": lux, "attributes": {}} for i in range(sensors)}
+
+
+def make_motion_app(args, states, name="motion"):
+    """Creates and initializes a motion app that is wired to a `FakeHass` instead of a running appdaemon."""
+    import motion
+
+    class FakeMotionApp(FakeHass, motion.App):
+        pass
+
+    app = FakeMotionApp(states, name=name)
+    app.args = with_storage_dir(args)
+    app.initialize()
+    return app
+
+
+def make_presence_args(persons=20):
+    """Generates the (unvalidated) app args of a presence app with a table of persons."""
+    return {
+        "just_left_delay": "5m",
+        "just_arrived_delay": "5m",
+        "extended_away_delay": "24h",
+        "persons": {
+            "person_{}".format(i): {
+                "tracker": "device_tracker.person_{}".format(i),
+                "state": "input_select.person_{}_state".format(i)
+            } for i in range(persons)
+        }
+    }
+
+
+def make_presence_states(persons=20):
+    """Generates the states of all entities referenced by `make_presence_args`."""
+    states = {}
+    for i in range(persons):
+        home = i % 2 == 0
+        states["device_tracker.person_{}".format(i)] = {"state": "home" if home else "not_home", "attributes": {}}
+        states["input_select.person_{}_state".format(i)] = {"state": "home" if home else "away", "attributes": {}}
+    return states
+
+
+def make_presence_app(args, states, name="presence"):
+    """Creates and initializes a presence app that is wired to a `FakeHass` instead of a running appdaemon."""
+    import presence
+
+    class FakePresenceApp(FakeHass, presence.App):
+        pass
+
+    app = FakePresenceApp(states, name=name)
+    app.args = with_storage_dir(args)
+    app.initialize()
+    return app
@@ -0,0 +1,146 @@
+"""
+Offline simulation of apps against a simulated home assistant. Time is simulated: Timers fire at their due time of
+the simulated clock and state changes are dispatched to the registered listeners, so a week (or a year) can be
+replayed in seconds without network access.
+
+Example:
+
+    sim = Simulation(climate.App, args, states, start=datetime.datetime(2019, 1, 7))
+    sim.run(until=start + datetime.timedelta(days=7), script=[(dt, "input_select.heating_mode", "energy"), ...])
+    sim.hass.calls  # Every service call as (simulated time, service, kwargs)
+"""
+import datetime
+import heapq
+import time
+
+from fakes import FakeHass, with_storage_dir
+
+
+class SimulatedHass(FakeHass):
+    """A `FakeHass` with a simulated clock, timers firing on that clock and listeners receiving state changes."""
+
+    def __init__(self, states=None, start=None, name="simulation"):
+        super().__init__(states, name)
+        self.now = start or datetime.datetime.now()
+        self.calls = []  # (simulated time, service, kwargs)
+        self.timer_fires = 0
+        self._queue = []  # Heap of (due, handle)
+        self._intervals = {}  # handle -> interval of repeating timers
+
+    def datetime(self):
+        return self.now
+
+    def _add_timer(self, callback, kwargs, due=None, interval=None):
+        handle = super()._add_timer(callback, kwargs)
+        if interval is not None:
+            self._intervals[handle] = interval
+        heapq.heappush(self._queue, (due or self.now, handle))
+        return handle
+
+    def run_in(self, callback, delay, **kwargs):
+        return self._add_timer(callback, kwargs, due=self.now + datetime.timedelta(seconds=delay))
+
+    def run_at(self, callback, start, **kwargs):
+        return self._add_timer(callback, kwargs, due=start)
+
+    def run_daily(self, callback, start, **kwargs):
+        due = datetime.datetime.combine(self.now.date(), start)
+        if due <= self.now:
+            due += datetime.timedelta(days=1)
+        return self._add_timer(callback, kwargs, due=due, interval=datetime.timedelta(days=1))
+
+    def run_every(self, callback, start, interval, **kwargs):
+        return self._add_timer(callback, kwargs, due=start, interval=datetime.timedelta(seconds=interval))
+
+    def cancel_timer(self, handle):
+        super().cancel_timer(handle)
+        self._intervals.pop(handle, None)
+
+    def advance(self, until):
+        """Fires every timer that is due until the given point in time (in order) and moves the clock there."""
+        while self._queue and self._queue[0][0] <= until:
+            due, handle = heapq.heappop(self._queue)
+            if handle not in self.timers:
+                continue  # Cancelled
+            callback, kwargs = self.timers[handle]
+            if handle in self._intervals:
+                heapq.heappush(self._queue, (due + self._intervals[handle], handle))
+            else:
+                del self.timers[handle]
+            self.now = max(self.now, due)
+            self.timer_fires += 1
+            callback(dict(kwargs))
+        self.now = max(self.now, until)
+
+    def set_entity_state(self, entity, state=None, **attributes):
+        """Changes the state of an entity like home assistant would and notifies the listeners."""
+        old = self.states.get(entity) or {"state": None, "attributes": {}}
+        new = {
+            "state": old["state"] if state is None else str(state),
+            "attributes": dict(old["attributes"], **attributes)
+        }
+        self.states[entity] = new
+        for callback, listened, kwargs in list(self.listeners.values()):
+            if listened != entity:
+                continue
+            attribute = kwargs.get("attribute")
+            if attribute == "all":
+                old_value, new_value = old, new
+            elif attribute is not None:
+                old_value, new_value = old["attributes"].get(attribute), new["attributes"].get(attribute)
+            else:
+                old_value, new_value = old["state"], new["state"]
+            if old_value == new_value:
+                continue
+            if "new" in kwargs and kwargs["new"] != new_value or "old" in kwargs and kwargs["old"] != old_value:
+                continue
+            callback(entity, attribute, old_value, new_value, kwargs)
+
+    def call_service(self, service, **kwargs):
+        super().call_service(service, **kwargs)
+        self.calls.append((self.now, service, kwargs))
+        entity = kwargs.get("entity_id")
+        for entity in entity if isinstance(entity, (list, tuple)) else [entity]:
+            if service == "input_number/set_value":
+                self.set_entity_state(entity, kwargs["value"])
+            elif service == "climate/set_temperature":
+                self.set_entity_state(entity, temperature=kwargs["temperature"])
+            elif service == "input_select/set_options":
+                self.set_entity_state(entity, kwargs["options"][0], options=kwargs["options"])
+            elif service == "input_select/select_option":
+                self.set_entity_state(entity, kwargs["option"])
+            elif service in ("homeassistant/turn_on", "homeassistant/turn_off"):
+                self.set_entity_state(entity, service.rsplit("_", 1)[1])
+
+
+class Simulation:
+    """Runs an app against a `SimulatedHass` and replays scripted state changes minute by minute."""
+
+    def __init__(self, app_cls, args, states, start, name="simulation"):
+        class SimulatedApp(SimulatedHass, app_cls):
+            pass
+
+        self.hass = SimulatedApp(states, start=start, name=name)
+        self.hass.args = with_storage_dir(args)
+        self.hass.initialize()
+
+    def run(self, until, script=(), step=datetime.timedelta(minutes=1)):
+        """
+        Replays the time from the current simulated time until `until` in the given steps. `script` is an iterable of
+        (datetime, entity, state) tuples that are applied at their point in time.
+
+        Returns the wall clock seconds the replay took.
+        """
+        events = sorted(script, key=lambda event: event[0])
+        pos = 0
+        started = time.perf_counter()
+        now = self.hass.now
+        while now < until:
+            now = min(now + step, until)
+            while pos < len(events) and events[pos][0] <= now:
+                due, entity, state = events[pos]
+                self.hass.advance(due)
+                self.hass.set_entity_state(entity, state)
+                pos += 1
+            self.hass.advance(now)
+        return time.perf_counter() - started